@@ -1,4 +1,12 @@
+import os
 import sqlite3
+import sys
+import zlib
+
+sys.path.append(os.path.abspath(__file__ + '/../../..'))
+from dbbot import QueryCache, RobotDatabase
+from dbbot.reader import DatabaseWriter
+from dbbot.partitions import find_partitions
 
 
 class RobotSqliteDatabase:
@@ -9,6 +17,45 @@ class RobotSqliteDatabase:
     def connect_to_database(self, db_file_path):
         self._connection = sqlite3.connect(db_file_path)
 
+    def connect_to_partitions(self, db_file_path):
+        database = RobotDatabase(':memory:', None)
+        database.attach_partitions(find_partitions(db_file_path))
+        self._connection = database._connection
+
+    def connect_to_database_with_query_cache(self, db_file_path, directory=None):
+        self._query_cache = QueryCache(directory=directory)
+        self._database = RobotDatabase(db_file_path, None, self._query_cache)
+        self._connection = self._database._connection
+
+    def connect_to_database_for_reading(self, db_file_path):
+        database = RobotDatabase(db_file_path, None)
+        self._connection = database.open_reader()._connection
+        database.close()
+
+    def writing_should_fail(self):
+        try:
+            self._connection.execute('CREATE TABLE written (id INTEGER)')
+        except sqlite3.OperationalError:
+            return
+        raise AssertionError('Expected writing to fail')
+
+    def cached_row_count_is_equal_to(self, count, db_table_name):
+        actual_count = list(self._database.query('SELECT count() FROM %s' % db_table_name))[0][0]
+        if not actual_count == int(count):
+            raise AssertionError('Expected to have %s rows but was %s' %
+                (count, actual_count))
+
+    def cached_test_run_source_should_be(self, source_file):
+        rows = list(self._database.query('SELECT source_file FROM test_runs'))
+        if [row[0] for row in rows] != [source_file]:
+            raise AssertionError('Expected test run from %s but was %s' %
+                (source_file, ', '.join(row[0] for row in rows)))
+
+    def query_cache_hits_should_be(self, hits):
+        if self._query_cache.hits != int(hits):
+            raise AssertionError('Expected %s query cache hits but had %d' %
+                (hits, self._query_cache.hits))
+
     def close_connection(self):
         self._connection.close()
 
@@ -18,6 +65,100 @@ class RobotSqliteDatabase:
             raise AssertionError('Expected to have %s rows but was %s' %
                 (count, actual_count))
 
+    def index_should_exist(self, index_name):
+        if not self._index_exists(index_name):
+            raise AssertionError('Expected index %s to exist' % index_name)
+
+    def index_should_not_exist(self, index_name):
+        if self._index_exists(index_name):
+            raise AssertionError('Expected index %s not to exist' % index_name)
+
+    def values_should_have_type(self, db_table_name, column_name, expected_type):
+        cursor = self._execute('SELECT DISTINCT typeof(%s) FROM %s' % (column_name, db_table_name))
+        actual_types = [row[0] for row in cursor]
+        if actual_types != [expected_type]:
+            raise AssertionError('Expected %s.%s to have %s values but had %s' %
+                (db_table_name, column_name, expected_type, ', '.join(actual_types)))
+
+    def compressed_strings_should_decompress(self):
+        cursor = self._execute('SELECT content FROM strings WHERE compressed = 1')
+        contents = [row[0] for row in cursor]
+        if not contents:
+            raise AssertionError('Expected to have compressed strings')
+        for content in contents:
+            zlib.decompress(str(content)).decode('UTF-8')
+
+    def rollups_should_match_statuses(self):
+        for rollup_name, status_table_name, key_column in (
+                ('suite_rollups', 'suite_status', 'suite_id'),
+                ('test_rollups', 'test_status', 'test_id'),
+                ('keyword_rollups', 'keyword_status', 'keyword_id')):
+            expected = self._execute("SELECT %s, count(), sum(status='FAIL'), sum(elapsed), "
+                                     "min(elapsed), max(elapsed), max(test_run_id) FROM %s "
+                                     "GROUP BY %s ORDER BY %s"
+                                     % (key_column, status_table_name, key_column, key_column))
+            actual = self._execute('SELECT %s, runs, failed, elapsed_total, elapsed_min, '
+                                   'elapsed_max, last_test_run_id FROM %s ORDER BY %s'
+                                   % (key_column, rollup_name, key_column))
+            if expected.fetchall() != actual.fetchall():
+                raise AssertionError('Expected %s to match %s' % (rollup_name, status_table_name))
+
+    def schema_version_should_be(self, version):
+        cursor = self._execute('SELECT max(version) FROM schema_version')
+        actual_version = cursor.fetchone()[0] or 0
+        if actual_version != int(version):
+            raise AssertionError('Expected schema version %s but was %s' %
+                (version, actual_version))
+
+    def table_should_not_exist(self, table_name):
+        cursor = self._execute("SELECT 1 FROM sqlite_master WHERE name='%s'" % table_name)
+        if cursor.fetchone() is not None:
+            raise AssertionError('Expected table %s not to exist' % table_name)
+
+    def drop_table(self, table_name):
+        self._execute('DROP TABLE %s' % table_name)
+        self._connection.commit()
+
+    # Gives test_runs and tests the definitions of databases created with
+    # Robot Framework 2.7, without the hash of the test runs and the UNIQUE
+    # constraint of the tests
+    def downgrade_schema(self):
+        self._execute('PRAGMA legacy_alter_table=ON')
+        self._execute('DELETE FROM schema_version')
+        self._recreate_table('test_runs', 'imported_at DATETIME NOT NULL, source_file TEXT, '
+                             'started_at DATETIME, finished_at DATETIME')
+        self._recreate_table('tests', 'suite_id INTEGER NOT NULL REFERENCES suites, '
+                             'xml_id TEXT NOT NULL, name TEXT NOT NULL, timeout TEXT, doc TEXT')
+        self._connection.commit()
+
+    def _recreate_table(self, table_name, column_definitions):
+        column_names = ', '.join(['id'] + [definition.split()[0] for definition
+                                           in column_definitions.split(', ')])
+        self._execute('ALTER TABLE %s RENAME TO old_%s' % (table_name, table_name))
+        self._execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, %s)' % (table_name,
+                                                                      column_definitions))
+        self._execute('INSERT INTO %s SELECT %s FROM old_%s' % (table_name, column_names,
+                                                               table_name))
+        self._execute('DROP TABLE old_%s' % table_name)
+
+    # Leaves the copy of the table like an interrupted migration would
+    def start_migration_of(self, table_name, rows):
+        template = DatabaseWriter('', None)
+        definition = template.table_definition(table_name)
+        template.close()
+        self._execute('CREATE TABLE migrating_%s %s' % (table_name,
+                                                         definition[definition.index('('):]))
+        column_names = ', '.join(row[1] for row in self._execute('PRAGMA table_info(%s)'
+                                                                 % table_name))
+        self._execute('INSERT INTO migrating_%s (%s) SELECT %s FROM %s ORDER BY id LIMIT %d'
+                      % (table_name, column_names, column_names, table_name, int(rows)))
+        self._connection.commit()
+
+    def _index_exists(self, index_name):
+        cursor = self._execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='%s'"
+                               % index_name)
+        return cursor.fetchone() is not None
+
     def _number_of_rows_in(self, db_table_name):
         cursor = self._execute('SELECT count() FROM %s' % db_table_name)
         return cursor.fetchone()[0]
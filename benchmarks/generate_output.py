@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import random
+import sys
+from datetime import datetime, timedelta
+from optparse import OptionParser
+
+
+DEFAULT_SHAPE = {
+    'suite_depth': 2,
+    'suites_per_suite': 3,
+    'tests_per_suite': 10,
+    'keyword_depth': 3,
+    'keywords_per_keyword': 3,
+    'messages_per_keyword': 2,
+    'message_bytes': 0,
+    'tags_per_test': 3,
+    'fail_ratio': 0.05,
+    'seed': 1
+}
+# Keyword and tag names are drawn from pools of this size, so that keywords
+# and tags repeat across tests like they do in real test runs
+KEYWORD_NAMES = 200
+TAG_NAMES = 20
+
+class OutputGenerator(object):
+
+    def __init__(self, stream, shape):
+        self._stream = stream
+        self._shape = dict(DEFAULT_SHAPE, **shape)
+        self._random = random.Random(self._shape['seed'])
+        self._time = datetime(2014, 1, 1)
+        self._indent = 0
+        self._passed = 0
+        self._failed = 0
+
+    def generate(self):
+        self._write('<?xml version="1.0" encoding="UTF-8"?>')
+        self._start('robot', generated=self._timestamp(), generator='DbBot benchmark generator')
+        self._suite('s1', 'Root', 0)
+        self._statistics()
+        self._empty('errors')
+        self._end('robot')
+
+    def _suite(self, suite_id, name, depth):
+        self._start('suite', id=suite_id, name=name, source='/benchmark/%s' % suite_id)
+        start = self._timestamp()
+        failed = self._failed
+        if depth < self._shape['suite_depth']:
+            for index in range(1, self._shape['suites_per_suite'] + 1):
+                self._suite('%s-s%d' % (suite_id, index), 'Suite %d' % index, depth + 1)
+        else:
+            self._keyword('setup', 1, failed=False)
+            for index in range(1, self._shape['tests_per_suite'] + 1):
+                self._test('%s-t%d' % (suite_id, index), 'Test %d' % index)
+        self._element('doc', 'Suite %s' % suite_id)
+        self._status('FAIL' if self._failed > failed else 'PASS', start)
+        self._end('suite')
+
+    def _test(self, test_id, name):
+        failed = self._random.random() < self._shape['fail_ratio']
+        self._start('test', id=test_id, name=name, timeout='')
+        start = self._timestamp()
+        count = self._shape['keywords_per_keyword']
+        for index in range(count):
+            self._keyword('kw', 1, failed and index == count - 1)
+        self._element('doc', 'Test %s' % test_id)
+        self._tags()
+        self._status('FAIL' if failed else 'PASS', start, critical='yes')
+        self._end('test')
+        if failed:
+            self._failed += 1
+        else:
+            self._passed += 1
+
+    def _keyword(self, kw_type, depth, failed):
+        index = self._random.randint(1, KEYWORD_NAMES)
+        self._start('kw', name='Library.Keyword %d' % index, timeout='', type=kw_type)
+        start = self._timestamp()
+        self._element('doc', 'Documentation of keyword %d' % index)
+        self._start('arguments')
+        self._element('arg', '${argument %d}' % index)
+        self._element('arg', str(depth))
+        self._end('arguments')
+        if depth < self._shape['keyword_depth']:
+            count = self._shape['keywords_per_keyword']
+            for child in range(count):
+                self._keyword('kw', depth + 1, failed and child == count - 1)
+        for message in range(self._shape['messages_per_keyword']):
+            text = 'Message %d of keyword %d on level %d' % (message, index, depth)
+            self._element('msg', text + self._payload(), level='INFO', timestamp=self._timestamp())
+        if failed:
+            self._element('msg', 'Keyword %d failed' % index, level='FAIL', timestamp=self._timestamp())
+        self._status('FAIL' if failed else 'PASS', start)
+        self._end('kw')
+
+    # Log-like lines of about message_bytes bytes, e.g. an HTTP response
+    # body, that differ between messages like real payloads do
+    def _payload(self):
+        lines = []
+        size = 0
+        while size < self._shape['message_bytes']:
+            line = '\n%s line %d: value=%d' % (self._timestamp(), len(lines) + 1,
+                                               self._random.randint(0, 100000))
+            lines.append(line)
+            size += len(line)
+        return ''.join(lines)
+
+    def _tags(self):
+        tags = sorted(set('tag-%d' % self._random.randint(1, TAG_NAMES)
+                          for _ in range(self._shape['tags_per_test'])))
+        self._start('tags')
+        for tag in tags:
+            self._element('tag', tag)
+        self._end('tags')
+
+    def _statistics(self):
+        self._start('statistics')
+        self._start('total')
+        self._element('stat', 'Critical Tests', fail=self._failed, **{'pass': self._passed})
+        self._element('stat', 'All Tests', fail=self._failed, **{'pass': self._passed})
+        self._end('total')
+        self._empty('tag')
+        self._start('suite')
+        self._element('stat', 'Root', fail=self._failed, id='s1', name='Root', **{'pass': self._passed})
+        self._end('suite')
+        self._end('statistics')
+
+    def _status(self, status, start, **attributes):
+        self._empty('status', endtime=self._timestamp(), starttime=start, status=status, **attributes)
+
+    def _timestamp(self):
+        self._time += timedelta(milliseconds=self._random.randint(1, 20))
+        return self._time.strftime('%Y%m%d %H:%M:%S.%f')[:-3]
+
+    def _start(self, tag, **attributes):
+        self._write('<%s%s>' % (tag, self._attributes(attributes)))
+        self._indent += 1
+
+    def _end(self, tag):
+        self._indent -= 1
+        self._write('</%s>' % tag)
+
+    def _empty(self, tag, **attributes):
+        self._write('<%s%s/>' % (tag, self._attributes(attributes)))
+
+    def _element(self, tag, text, **attributes):
+        self._write('<%s%s>%s</%s>' % (tag, self._attributes(attributes), text, tag))
+
+    def _attributes(self, attributes):
+        return ''.join(' %s="%s"' % item for item in sorted(attributes.items()))
+
+    def _write(self, line):
+        self._stream.write('    ' * self._indent + line + '\n')
+
+
+def generate(path, shape):
+    with open(path, 'w') as stream:
+        OutputGenerator(stream, shape).generate()
+
+
+def _parse_options():
+    parser = OptionParser(usage='%prog [options] OUTPUT')
+    for name, default in sorted(DEFAULT_SHAPE.items()):
+        parser.add_option('--' + name.replace('_', '-'), dest=name, default=default,
+                          type='float' if isinstance(default, float) else 'int',
+                          help='(default: %default)')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('output file is required')
+    return dict((name, getattr(options, name)) for name in DEFAULT_SHAPE), args[0]
+
+
+if __name__ == '__main__':
+    shape, path = _parse_options()
+    generate(path, shape)
+    sys.stdout.write('%s\n' % path)
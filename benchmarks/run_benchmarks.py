@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import cPickle
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+from os.path import abspath, dirname, exists, getsize, join
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, abspath(join(dirname(abspath(__file__)), '..')))
+from dbbot import __version__
+from dbbot.reader import DatabaseWriter, ParallelImporter, RobotResultsParser, StreamingResultsParser
+from dbbot.reader.database_writer import DEFAULT_BATCH_SIZE
+from dbbot.reader.parallel_importer import RowRecorder
+from generate_output import DEFAULT_SHAPE, generate
+from robot.version import get_version
+
+
+SHAPES = {
+    'small': {'suite_depth': 1, 'suites_per_suite': 2, 'tests_per_suite': 10,
+              'keyword_depth': 2, 'keywords_per_keyword': 2},
+    'medium': {},
+    'large': {'suites_per_suite': 4, 'tests_per_suite': 50},
+    'deep': {'suite_depth': 5, 'suites_per_suite': 2, 'tests_per_suite': 5,
+             'keyword_depth': 6, 'keywords_per_keyword': 2},
+    'messages': {'keyword_depth': 2, 'messages_per_keyword': 20},
+    'payloads': {'keyword_depth': 2, 'messages_per_keyword': 5, 'message_bytes': 4096}
+}
+DEFAULT_SHAPES = ['small', 'medium']
+
+class BenchmarkOptions(object):
+
+    def __init__(self):
+        self._parser = OptionParser(usage='%prog [options]')
+        self._add_parser_options()
+        self._options = self._get_validated_options()
+
+    def _add_parser_options(self):
+        options = [
+            ('--shape', {'action': 'append',
+                         'dest': 'shapes',
+                         'metavar': 'NAME',
+                         'help': 'output.xml shape to benchmark, one of %s, can be given '
+                                 'multiple times (default: %s)' % (
+                                     ', '.join(sorted(SHAPES)), ', '.join(DEFAULT_SHAPES))}),
+
+            ('-k', '--also-keywords', {'action': 'store_true',
+                                       'default': False,
+                                       'dest': 'include_keywords',
+                                       'help': 'parse also suites\' and tests\' keywords'}),
+
+            ('-s', '--streaming', {'action': 'store_true',
+                                   'default': False,
+                                   'dest': 'streaming',
+                                   'help': 'benchmark the streaming parser'}),
+
+            ('--bulk', {'action': 'store_true',
+                        'default': False,
+                        'dest': 'bulk',
+                        'help': 'write with the bulk load settings'}),
+
+            ('--compress-threshold', {'type': 'int',
+                                      'dest': 'compress_threshold',
+                                      'metavar': 'BYTES',
+                                      'help': 'write with --compress-threshold BYTES'}),
+
+            ('--repeat', {'type': 'int',
+                          'default': 1,
+                          'dest': 'repeat',
+                          'help': 'number of times to run each benchmark (default: %default)'}),
+
+            ('--output', {'dest': 'output',
+                          'metavar': 'FILE',
+                          'help': 'append the results to FILE instead of printing them'}),
+
+            ('--workdir', {'dest': 'workdir',
+                           'metavar': 'DIR',
+                           'help': 'directory for the generated files, which are kept and '
+                                   'reused (default: a temporary directory)'})
+        ]
+        for option in options:
+            self._parser.add_option(*option[:-1], **option[-1])
+
+    def _get_validated_options(self):
+        options, args = self._parser.parse_args()
+        if args:
+            self._parser.error('no arguments expected')
+        options.shapes = options.shapes or DEFAULT_SHAPES
+        for shape in options.shapes:
+            if shape not in SHAPES:
+                self._parser.error('unknown shape "%s"' % shape)
+        if options.repeat < 1:
+            self._parser.error('repeat must be at least 1')
+        return options
+
+    def __getattr__(self, name):
+        return getattr(self._options, name)
+
+
+class Benchmark(object):
+
+    def __init__(self):
+        self._options = BenchmarkOptions()
+        self._workdir = self._options.workdir or tempfile.mkdtemp(prefix='dbbot-benchmark-')
+        if not exists(self._workdir):
+            os.makedirs(self._workdir)
+
+    def run(self):
+        try:
+            for name in self._options.shapes:
+                xml_file = self._generate(name)
+                for run in range(1, self._options.repeat + 1):
+                    self._report(self._run(name, xml_file, run))
+        finally:
+            if not self._options.workdir:
+                shutil.rmtree(self._workdir)
+
+    def _generate(self, name):
+        xml_file = join(self._workdir, '%s.xml' % name)
+        if not exists(xml_file):
+            generate(xml_file, SHAPES[name])
+        return xml_file
+
+    def _run(self, name, xml_file, run):
+        batch_file = join(self._workdir, '%s.batches' % name)
+        db_file = join(self._workdir, '%s.db' % name)
+        for path in (db_file, db_file + '-wal', db_file + '-shm'):
+            if exists(path):
+                os.remove(path)
+        parse = _in_child(_parse, xml_file, batch_file, self._options.streaming,
+                          self._options.include_keywords)
+        write = _in_child(_write, xml_file, batch_file, db_file, self._options.bulk,
+                          self._options.compress_threshold, self._options.include_keywords)
+        os.remove(batch_file)
+        rows = _count_rows(db_file)
+        return {
+            'benchmark': name,
+            'run': run,
+            'shape': dict(DEFAULT_SHAPE, **SHAPES[name]),
+            'parser': 'streaming' if self._options.streaming else 'model',
+            'keywords': self._options.include_keywords,
+            'bulk': self._options.bulk,
+            'compress_threshold': self._options.compress_threshold,
+            'file_bytes': getsize(xml_file),
+            'db_bytes': getsize(db_file),
+            'rows': rows,
+            'parse_seconds': round(parse['seconds'], 4),
+            'parse_rows_per_second': int(rows / parse['seconds']),
+            'parse_peak_rss_kb': parse['peak_rss_kb'],
+            'write_seconds': round(write['seconds'], 4),
+            'write_rows_per_second': int(rows / write['seconds']),
+            'write_peak_rss_kb': write['peak_rss_kb'],
+            'dbbot_version': __version__,
+            'robot_version': get_version(),
+            'python_version': platform.python_version(),
+            'sqlite_version': sqlite3.sqlite_version,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+    def _report(self, result):
+        line = json.dumps(result, sort_keys=True) + '\n'
+        if self._options.output:
+            with open(self._options.output, 'a') as output:
+                output.write(line)
+        else:
+            sys.stdout.write(line)
+
+
+# Each phase runs in its own process so that the peak RSS is its own
+def _in_child(target, *args):
+    results = Queue()
+    process = Process(target=target, args=args + (results,))
+    process.start()
+    process.join()
+    if results.empty():
+        raise RuntimeError('Benchmark process failed with exit code %s' % process.exitcode)
+    return results.get()
+
+
+# The parsers write through a RowRecorder into a file of pickled batches,
+# which the writer phase then replays. Pickling and unpickling are excluded
+# from the timings.
+def _parse(xml_file, batch_file, streaming, include_keywords, results):
+    db = DatabaseWriter('', None)
+    unique_columns = db.unique_columns
+    db.close()
+    with _BatchFile(batch_file) as batches:
+        recorder = RowRecorder(unique_columns, DEFAULT_BATCH_SIZE, batches)
+        parser_class = StreamingResultsParser if streaming else RobotResultsParser
+        start = time.time()
+        parser_class(include_keywords, recorder, None).xml_to_db(xml_file)
+        recorder.flush()
+        seconds = time.time() - start - batches.seconds
+    results.put({'seconds': seconds, 'peak_rss_kb': _peak_rss_kb()})
+
+
+def _write(xml_file, batch_file, db_file, bulk, compress_threshold, include_keywords, results):
+    timer = _Timer()
+    start = time.time()
+    db = DatabaseWriter(db_file, None, compress_threshold=compress_threshold)
+    if bulk:
+        db.configure_for_bulk_load()
+        db.drop_indexes()
+    importer = ParallelImporter(None, include_keywords, db, None, 1, DEFAULT_BATCH_SIZE)
+    importer.write(xml_file, _read_batches(batch_file, timer))
+    if bulk:
+        db.create_indexes()
+        db.restore_configuration()
+        db.analyze()
+    db.commit()
+    db.close()
+    results.put({'seconds': time.time() - start - timer.seconds, 'peak_rss_kb': _peak_rss_kb()})
+
+
+class _BatchFile(object):
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self.seconds = 0.0
+
+    def put(self, message):
+        start = time.time()
+        cPickle.dump(message[1], self._file, cPickle.HIGHEST_PROTOCOL)
+        self.seconds += time.time() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        self._file.close()
+
+
+class _Timer(object):
+
+    def __init__(self):
+        self.seconds = 0.0
+
+
+def _read_batches(path, timer):
+    with open(path, 'rb') as batches:
+        while True:
+            start = time.time()
+            try:
+                batch = cPickle.load(batches)
+            except EOFError:
+                return
+            finally:
+                timer.seconds += time.time() - start
+            yield batch
+
+
+def _peak_rss_kb():
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _count_rows(db_file):
+    connection = sqlite3.connect(db_file)
+    try:
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        return sum(connection.execute('SELECT count() FROM %s' % table).fetchone()[0]
+                   for table in tables)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    Benchmark().run()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from os.path import abspath, dirname, exists, join
+
+sys.path.insert(0, abspath(join(dirname(abspath(__file__)), '..')))
+from dbbot import __version__
+from generate_output import generate
+
+
+DBBOT = abspath(join(dirname(abspath(__file__)), '..', 'dbbot', 'run.py'))
+SMALL_SHAPE = {'suite_depth': 1, 'suites_per_suite': 2, 'tests_per_suite': 10,
+               'keyword_depth': 2, 'keywords_per_keyword': 2}
+# Command line arguments of each scenario. The database is created anew for
+# 'import' and holds the imported file for the others.
+SCENARIOS = [
+    ('python', None),
+    ('help', ['--help']),
+    ('incremental_skip', ['--incremental', '$xml']),
+    ('streaming_skip', ['--streaming', '$xml']),
+    ('watch_idle', ['--watch', '$spool', '--exit-when-idle', '--poll-interval', '0.01']),
+    ('import', ['$xml'])
+]
+
+class StartupBenchmarkOptions(object):
+
+    def __init__(self):
+        self._parser = OptionParser(usage='%prog [options]')
+        self._add_parser_options()
+        self._options = self._get_validated_options()
+
+    def _add_parser_options(self):
+        options = [
+            ('--scenario', {'action': 'append',
+                            'dest': 'scenarios',
+                            'metavar': 'NAME',
+                            'help': 'scenario to benchmark, one of %s, can be given multiple '
+                                    'times (default: all)' % ', '.join(name for name, _ in SCENARIOS)}),
+
+            ('--repeat', {'type': 'int',
+                          'default': 10,
+                          'dest': 'repeat',
+                          'help': 'number of times to start dbbot in each scenario '
+                                  '(default: %default)'}),
+
+            ('--output', {'dest': 'output',
+                          'metavar': 'FILE',
+                          'help': 'append the results to FILE instead of printing them'})
+        ]
+        for option in options:
+            self._parser.add_option(*option[:-1], **option[-1])
+
+    def _get_validated_options(self):
+        options, args = self._parser.parse_args()
+        if args:
+            self._parser.error('no arguments expected')
+        names = [name for name, _ in SCENARIOS]
+        options.scenarios = options.scenarios or names
+        for scenario in options.scenarios:
+            if scenario not in names:
+                self._parser.error('unknown scenario "%s"' % scenario)
+        if options.repeat < 1:
+            self._parser.error('repeat must be at least 1')
+        return options
+
+    def __getattr__(self, name):
+        return getattr(self._options, name)
+
+
+# Times whole dbbot processes from start to exit, which is what wrappers
+# calling dbbot once per file or shard pay, interpreter start-up included
+class StartupBenchmark(object):
+
+    def __init__(self):
+        self._options = StartupBenchmarkOptions()
+        self._workdir = tempfile.mkdtemp(prefix='dbbot-startup-')
+        self._paths = {
+            'xml': join(self._workdir, 'small.xml'),
+            'spool': join(self._workdir, 'spool'),
+            'db': join(self._workdir, 'startup.db')
+        }
+
+    def run(self):
+        try:
+            generate(self._paths['xml'], SMALL_SHAPE)
+            os.makedirs(self._paths['spool'])
+            self._dbbot(['--incremental', self._paths['xml']])
+            for name, arguments in SCENARIOS:
+                if name in self._options.scenarios:
+                    self._report(self._run(name, arguments))
+        finally:
+            shutil.rmtree(self._workdir)
+
+    def _run(self, name, arguments):
+        times = []
+        for _ in range(self._options.repeat):
+            if name == 'import':
+                self._remove_database()
+            start = time.time()
+            if arguments is None:
+                self._execute([sys.executable, '-c', 'pass'])
+            else:
+                self._dbbot(arguments)
+            times.append(time.time() - start)
+        times.sort()
+        return {
+            'benchmark': 'startup',
+            'scenario': name,
+            'runs': len(times),
+            'min_seconds': round(times[0], 4),
+            'median_seconds': round(times[len(times) // 2], 4),
+            'max_seconds': round(times[-1], 4),
+            'dbbot_version': __version__,
+            'python_version': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+    def _dbbot(self, arguments):
+        arguments = [self._paths[argument[1:]] if argument.startswith('$') else argument
+                     for argument in arguments]
+        self._execute([sys.executable, DBBOT, '-b', self._paths['db']] + arguments)
+
+    def _execute(self, command):
+        with open(os.devnull, 'w') as devnull:
+            rc = subprocess.call(command, stdout=devnull, stderr=devnull)
+        if rc != 0:
+            raise RuntimeError('Command %s failed with exit code %d' % (' '.join(command), rc))
+
+    def _remove_database(self):
+        for path in (self._paths['db'], self._paths['db'] + '-wal', self._paths['db'] + '-shm'):
+            if exists(path):
+                os.remove(path)
+
+    def _report(self, result):
+        line = json.dumps(result, sort_keys=True) + '\n'
+        if self._options.output:
+            with open(self._options.output, 'a') as output:
+                output.write(line)
+        else:
+            sys.stdout.write(line)
+
+
+if __name__ == '__main__':
+    StartupBenchmark().run()
@@ -15,5 +15,7 @@
 __version__ = '0.2-devel'
 
 from .logger import Logger
+from .metrics import Metrics
+from .query_cache import QueryCache
 from .robot_database import RobotDatabase
 
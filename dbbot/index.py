@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import os
+import sys
+from optparse import OptionParser
+
+sys.path.append(os.path.abspath(__file__ + '/../..'))
+from dbbot import RobotDatabase
+from dbbot.reader.reader_options import DEFAULT_DB_NAME
+
+
+ACTIONS = ('create', 'drop', 'rebuild')
+
+class IndexOptions(object):
+
+    def __init__(self):
+        self._parser = OptionParser(usage='%prog [options] ' + '|'.join(ACTIONS))
+        self._add_parser_options()
+        self._options, self._action = self._get_validated_options()
+
+    def _add_parser_options(self):
+        options = [
+            ('-v', '--verbose', {'action': 'store_true',
+                                 'default': False,
+                                 'dest': 'be_verbose',
+                                 'help': 'be verbose about the operation'}),
+
+            ('-b', '--database', {'dest': 'db_file_path',
+                                  'default': DEFAULT_DB_NAME,
+                                  'help': 'path to the SQLite database for test run results'})
+        ]
+        for option in options:
+            self._parser.add_option(*option[:-1], **option[-1])
+
+    def _get_validated_options(self):
+        options, args = self._parser.parse_args()
+        if len(args) != 1 or args[0] not in ACTIONS:
+            self._parser.error('one of the actions %s is required' % ', '.join(ACTIONS))
+        if not os.path.exists(options.db_file_path):
+            self._parser.error('database "%s" does not exist' % options.db_file_path)
+        return options, args[0]
+
+    @property
+    def db_file_path(self):
+        return self._options.db_file_path
+
+    @property
+    def be_verbose(self):
+        return self._options.be_verbose
+
+    @property
+    def action(self):
+        return self._action
+
+
+class DbBotIndex(object):
+
+    def __init__(self):
+        self._options = IndexOptions()
+        verbose_stream = sys.stdout if self._options.be_verbose else None
+        # Only the indexes are changed, not the tables of an older schema
+        self._db = RobotDatabase(self._options.db_file_path, verbose_stream)
+
+    def run(self):
+        try:
+            if self._options.action in ('drop', 'rebuild'):
+                self._db.drop_indexes()
+            if self._options.action in ('create', 'rebuild'):
+                self._db.create_indexes()
+            self._db.commit()
+        finally:
+            self._db.close()
+
+
+if __name__ == '__main__':
+    DbBotIndex().run()
@@ -17,6 +17,10 @@ class Logger(object):
         self._header = header
         self._stream = stream
 
-    def __call__(self, message):
+    # Formatting arguments are applied only when the message is written, so
+    # that frequent messages cost little when not being verbose
+    def __call__(self, message, *args):
         if self._stream:
+            if args:
+                message = message % args
             self._stream.write(' %-8s |   %s\n' % (self._header, message))
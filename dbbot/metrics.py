@@ -0,0 +1,75 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from time import time
+
+
+# Collects named timers and counters. A disabled instance ignores every call,
+# so the importer can be instrumented without slowing down normal runs.
+class Metrics(object):
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._timers = {}
+        self._counters = {}
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def add_time(self, name, seconds, calls=1):
+        if self.enabled:
+            total, count = self._timers.get(name, (0.0, 0))
+            self._timers[name] = (total + seconds, count + calls)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    # Adds the summary of another instance, e.g. one from a worker process
+    def merge(self, summary):
+        for name, timer in summary['timers'].items():
+            self.add_time(name, timer['seconds'], timer['calls'])
+        for name, amount in summary['counters'].items():
+            self.count(name, amount)
+
+    def summary(self):
+        return {
+            'timers': dict((name, {'seconds': round(total, 6), 'calls': count})
+                           for name, (total, count) in self._timers.items()),
+            'counters': dict(self._counters)
+        }
+
+
+class _Timer(object):
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time()
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        self._metrics.add_time(self._name, time() - self._start)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import os
+import re
+import sqlite3
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.abspath(__file__ + '/../..'))
+from dbbot import Logger, RobotDatabase
+from dbbot.reader import DatabaseWriter
+from dbbot.reader.database_writer import SCHEMA_VERSION
+from dbbot.reader.reader_options import DEFAULT_DB_NAME
+
+
+DEFAULT_CHUNK_SIZE = 50000
+COPY_PREFIX = 'migrating_'
+
+# Migrations as (version, name, tables rebuilt with their current
+# definitions, SQL expressions for the columns their old tables lack). The
+# rows keep their ids. A new schema version adds its migration here and
+# bumps SCHEMA_VERSION, which new databases start from.
+MIGRATIONS = (
+    (1, 'Robot Framework 2.8', ('test_runs', 'tests', 'keywords'), {
+        'test_runs': {'hash': "'migrated-' || id"}
+    }),
+)
+
+class MigrateOptions(object):
+
+    def __init__(self):
+        self._parser = OptionParser(usage='%prog [options]')
+        self._add_parser_options()
+        self._options = self._get_validated_options()
+
+    def _add_parser_options(self):
+        options = [
+            ('-v', '--verbose', {'action': 'store_true',
+                                 'default': False,
+                                 'dest': 'be_verbose',
+                                 'help': 'be verbose about the operation'}),
+
+            ('-b', '--database', {'dest': 'db_file_path',
+                                  'default': DEFAULT_DB_NAME,
+                                  'help': 'path to the SQLite database for test run results'}),
+
+            ('--chunk-size', {'type': 'int',
+                              'default': DEFAULT_CHUNK_SIZE,
+                              'dest': 'chunk_size',
+                              'metavar': 'N',
+                              'help': 'copy the rows of rebuilt tables N ids at a time, '
+                                      'each chunk in a transaction of its own '
+                                      '(default: %default)'}),
+
+            ('--dry-run', {'action': 'store_true',
+                           'default': False,
+                           'dest': 'dry_run',
+                           'help': 'only estimate the rows to copy, the disk space and '
+                                   'the time the pending migrations take'})
+        ]
+        for option in options:
+            self._parser.add_option(*option[:-1], **option[-1])
+
+    def _get_validated_options(self):
+        options, args = self._parser.parse_args()
+        if args:
+            self._parser.error('no arguments expected')
+        if options.chunk_size < 1:
+            self._parser.error('chunk size must be at least 1')
+        if not os.path.exists(options.db_file_path):
+            self._parser.error('database "%s" does not exist' % options.db_file_path)
+        return options
+
+    def __getattr__(self, name):
+        return getattr(self._options, name)
+
+
+# Brings the schema of an existing database up to SCHEMA_VERSION. A table
+# is rebuilt by copying it into migrating_<name> in chunks of ids, each
+# committed on its own, so that the write lock is held only briefly, readers
+# keep using the original meanwhile and an interrupted copy is resumed from
+# its largest id. The original is then replaced by the copy in one
+# transaction, which also copies the rows added meanwhile, and its indexes
+# are created again. Only one table is copied at a time, so the extra disk
+# space needed is about the size of the largest one.
+class Migrator(object):
+
+    def __init__(self, db, progress_stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._db = db
+        self._progress = Logger('Migrate', progress_stream)
+        self._chunk_size = chunk_size
+        self._template = DatabaseWriter('', None, epoch_timestamps=self._epoch_timestamps())
+        # Like the copies, which get their indexes once complete
+        self._template.drop_indexes()
+
+    # The timestamp format of the database is kept, see DatabaseWriter
+    def _epoch_timestamps(self):
+        return any(row[1] == 'imported_at' and row[2] == 'INTEGER'
+                   for row in self._db.query('PRAGMA table_info(test_runs)'))
+
+    def pending_migrations(self):
+        version = self._db.schema_version()
+        return [migration for migration in MIGRATIONS if migration[0] > version]
+
+    def migrate(self):
+        for version, name, table_names, expressions in self.pending_migrations():
+            self._progress('- Migrating to schema version %d (%s)' % (version, name))
+            rebuilt_tables = self._tables_to_rebuild(table_names)
+            for table_name in rebuilt_tables:
+                self._rebuild(table_name, expressions.get(table_name, {}))
+            self._progress('- Creating indexes')
+            self._db.create_indexes(rebuilt_tables)
+            self._db.set_schema_version(version)
+            self._db.commit()
+
+    # Returns (version, name, table, rows, chunks, bytes, seconds) for each
+    # table to rebuild, only reading the database. The bytes are None without
+    # the dbstat table of SQLite. The seconds are extrapolated from copying
+    # the first chunk into the template.
+    def estimate(self):
+        estimates = []
+        for version, name, table_names, expressions in self.pending_migrations():
+            for table_name in self._tables_to_rebuild(table_names):
+                estimates.append((version, name, table_name) +
+                                 self._estimate(table_name, expressions.get(table_name, {})))
+        return estimates
+
+    # Tables already matching their current definitions are left as they are,
+    # e.g. the ones of databases created by newer versions of DbBot
+    def _tables_to_rebuild(self, table_names):
+        return [table_name for table_name in table_names
+                if self._db.table_definition(table_name) and (
+                    self._db.table_definition(COPY_PREFIX + table_name) or
+                    _columns_of(self._db.table_definition(table_name)) !=
+                    _columns_of(self._template.table_definition(table_name)))]
+
+    def _rebuild(self, table_name, expressions):
+        copy_name = COPY_PREFIX + table_name
+        if self._db.table_definition(copy_name):
+            self._progress('- %s: resuming the copy' % table_name)
+        else:
+            self._create_copy(table_name, copy_name)
+        column_names = self._copied_columns(table_name, expressions)
+        total = self._row_count(table_name)
+        copied = self._row_count(copy_name)
+        first_id, last_id = self._next_ids(table_name, copy_name)
+        while first_id <= last_id:
+            copied += self._db.copy_table(table_name, copy_name, column_names,
+                                          (first_id, first_id + self._chunk_size - 1),
+                                          expressions)
+            self._db.commit()
+            self._progress('- %s: %d/%d rows copied (%d%%)' % (
+                table_name, copied, total, copied * 100 // total if total else 100))
+            first_id += self._chunk_size
+        self._progress('- %s: replacing with %s' % (table_name, copy_name))
+        with self._db.transaction():
+            first_id, last_id = self._next_ids(table_name, copy_name)
+            if first_id <= last_id:
+                self._db.copy_table(table_name, copy_name, column_names,
+                                    (first_id, last_id), expressions)
+            self._db.drop_table(table_name)
+            self._db.rename_table(copy_name, table_name)
+
+    def _create_copy(self, table_name, copy_name):
+        self._db.create_table_like(copy_name, self._template.table_definition(table_name))
+
+    def _copied_columns(self, table_name, expressions):
+        column_names = _column_names(self._db, table_name)
+        return [column_name for column_name in _column_names(self._template, table_name)
+                if column_name in column_names and column_name not in expressions]
+
+    def _row_count(self, table_name):
+        return self._db.query('SELECT count() FROM %s' % table_name).fetchone()[0]
+
+    # The ids after the largest one copied up to the largest one of the table
+    def _next_ids(self, table_name, copy_name):
+        copied_id = self._db.query('SELECT max(id) FROM %s' % copy_name).fetchone()[0]
+        first_id, last_id = self._id_range(table_name)
+        if copied_id is not None:
+            first_id = copied_id + 1
+        return first_id, last_id
+
+    def _estimate(self, table_name, expressions):
+        rows = self._row_count(table_name)
+        first_id, last_id = self._id_range(table_name)
+        chunks = (last_id - first_id) // self._chunk_size + 1 if rows else 0
+        return rows, chunks, self._size_of(table_name), self._sample(table_name, expressions,
+                                                                     rows, first_id)
+
+    def _id_range(self, table_name):
+        first_id, last_id = self._db.query('SELECT min(id), max(id) FROM %s' %
+                                           table_name).fetchone()
+        return first_id or 0, last_id if last_id is not None else -1
+
+    # The table and the indexes of its UNIQUE constraint are copied, the other
+    # indexes are dropped with the original and created again
+    def _size_of(self, table_name):
+        sql_statement = '''
+            SELECT sum(pgsize) FROM dbstat WHERE name IN (
+                SELECT name FROM sqlite_master WHERE tbl_name = ? AND
+                (type = 'table' OR name LIKE 'sqlite_autoindex_%')
+            )
+        '''
+        try:
+            return self._db.query(sql_statement, [table_name]).fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return None
+
+    # The template has the table with the definition the rebuilt one gets,
+    # so the first chunk is copied there and then rolled back
+    def _sample(self, table_name, expressions, rows, first_id):
+        if not rows:
+            return 0.0
+        column_names = self._copied_columns(table_name, expressions)
+        values = column_names + [expressions[name] for name in sorted(expressions)]
+        sql_statement = 'SELECT %s FROM %s WHERE id BETWEEN ? AND ?' % (', '.join(values),
+                                                                        table_name)
+        start = time.time()
+        sample = self._db.query(sql_statement,
+                                [first_id, first_id + self._chunk_size - 1]).fetchall()
+        self._template.insert_many_or_ignore(table_name, column_names + sorted(expressions),
+                                             sample)
+        self._template.flush()
+        elapsed = time.time() - start
+        self._template.rollback()
+        return elapsed * rows / max(len(sample), 1)
+
+    def close(self):
+        self._template.close()
+
+
+def _column_names(db, table_name):
+    return [row[1] for row in db.query('PRAGMA table_info(%s)' % table_name)]
+
+
+# Compares the column and constraint definitions regardless of the name of
+# the table, which SQLite quotes in the definitions of renamed tables
+def _columns_of(table_definition):
+    return re.sub(r'\s+', ' ', table_definition[table_definition.index('('):])
+
+
+class DbBotMigrate(object):
+
+    def __init__(self):
+        self._options = MigrateOptions()
+        verbose_stream = sys.stdout if self._options.be_verbose else None
+        # A dry run only reads the database
+        if self._options.dry_run:
+            self._db = RobotDatabase(self._options.db_file_path, verbose_stream,
+                                     read_only=True)
+        else:
+            self._db = DatabaseWriter(self._options.db_file_path, verbose_stream)
+        self._migrator = Migrator(self._db, sys.stdout, self._options.chunk_size)
+
+    def run(self):
+        try:
+            version = self._db.schema_version()
+            if version > SCHEMA_VERSION:
+                sys.exit('dbbot: error: database schema version %d is newer than the '
+                         'supported version %d' % (version, SCHEMA_VERSION))
+            if self._options.dry_run:
+                self._report(self._migrator.estimate())
+            else:
+                self._migrator.migrate()
+        finally:
+            self._migrator.close()
+            self._db.close()
+
+    def _report(self, estimates):
+        pending_migrations = self._migrator.pending_migrations()
+        if not pending_migrations:
+            sys.stdout.write('Database is at schema version %d\n' % self._db.schema_version())
+        for version, name, _, _ in pending_migrations:
+            tables = [estimate[2:] for estimate in estimates if estimate[0] == version]
+            if not tables:
+                sys.stdout.write('Version %d (%s): no tables to rebuild, the database would '
+                                 'only be marked as version %d\n' % (version, name, version))
+            for table_name, rows, chunks, size, seconds in tables:
+                sys.stdout.write('Version %d (%s): %s, %d rows in %d chunks, %s, about %.1f s\n'
+                                 % (version, name, table_name, rows, chunks,
+                                    'unknown size' if size is None
+                                    else '%.1f MB' % (size / 1024.0 / 1024.0), seconds))
+        sizes = [estimate[5] for estimate in estimates if estimate[5] is not None]
+        if sizes:
+            sys.stdout.write('Extra disk space needed: about %.1f MB\n' %
+                             (max(sizes) / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    DbBotMigrate().run()
@@ -0,0 +1,95 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import glob
+import os
+import re
+from datetime import datetime, timedelta
+
+
+# Lengths of the partition keys, which are the leading YYYY-MM-DD parts of
+# the start times of the test runs in the partition
+PERIODS = {
+    'year': 4,
+    'month': 7,
+    'day': 10
+}
+
+_KEY_PATTERN = re.compile(r'-(\d{4}(-\d\d(-\d\d)?)?)$')
+_DATE_PATTERN = re.compile(r'\d{4}(-\d\d(-\d\d)?)?$')
+
+# The partitions of robot_results.db are e.g. robot_results-2014-01.db.
+# The temporary database '' used by dry runs has temporary partitions.
+def partition_path(db_file_path, key):
+    if not db_file_path:
+        return ''
+    base, extension = os.path.splitext(db_file_path)
+    return '%s-%s%s' % (base, key, extension)
+
+
+# Robot Framework timestamps look like '20140131 23:59:59.999'
+def partition_key(robot_timestamp, period):
+    date = '%s-%s-%s' % (robot_timestamp[:4], robot_timestamp[4:6], robot_timestamp[6:8])
+    return date[:PERIODS[period]]
+
+
+# Returns the paths of the existing partitions of the database in the order
+# of their keys. With since and until, given as YYYY-MM-DD or a part of it,
+# only the partitions of the periods overlapping them are returned.
+def find_partitions(db_file_path, since=None, until=None):
+    base, extension = os.path.splitext(db_file_path)
+    partitions = []
+    for path in glob.glob('%s-*%s' % (_escape(base), _escape(extension))):
+        match = _KEY_PATTERN.search(os.path.splitext(path)[0])
+        if match and os.path.splitext(path)[0][:match.start()] == base:
+            key = match.group(1)
+            if _overlaps(key, since, until):
+                partitions.append((key, path))
+    return [path for key, path in sorted(partitions)]
+
+
+def is_period(date):
+    if not _DATE_PATTERN.match(date):
+        return False
+    try:
+        period_bounds(date)
+    except ValueError:
+        return False
+    return True
+
+
+# Returns the start of the period, e.g. a month given as 2014-01, and the
+# start of the next one as datetimes
+def period_bounds(date):
+    start = datetime.strptime(date, {4: '%Y', 7: '%Y-%m', 10: '%Y-%m-%d'}[len(date)])
+    if len(date) == 4:
+        return start, start.replace(year=start.year + 1)
+    if len(date) == 7:
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+    return start, start + timedelta(days=1)
+
+
+# Keys and dates are compared up to the shorter of them, so that e.g. the
+# partition 2014-01 overlaps the day 2014-01-15 and the other way round
+def _overlaps(key, since, until):
+    if since and key[:len(since)] < since[:len(key)]:
+        return False
+    if until and key[:len(until)] > until[:len(key)]:
+        return False
+    return True
+
+
+def _escape(pattern):
+    return re.sub(r'([*?[])', r'[\1]', pattern)
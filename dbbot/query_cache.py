@@ -0,0 +1,199 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import cPickle as pickle
+import hashlib
+import os
+import threading
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Rough per row and per value overhead of the cached rows in memory
+ROW_BYTES = 64
+VALUE_BYTES = 16
+
+# Keeps the results of read queries in memory and, with a directory, in
+# files shared by the processes reading the same database. The entries are
+# keyed by the query, its parameters and the generation of the database, see
+# RobotDatabase.query(), so the results of an earlier generation are never
+# returned. Results larger than a quarter of the limit are not cached.
+# Connections reading in different threads can share the cache.
+class QueryCache(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes if max_disk_bytes is not None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # Returns the column names and rows of the query, or None
+    def get(self, key, generation):
+        with self._lock:
+            return self._get(key, generation)
+
+    def _get(self, key, generation):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == generation:
+            entry[3] = self._tick()
+            self.hits += 1
+            return entry[1]
+        result = self._read(key, generation)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        size = self._size_of(result[1])
+        if size <= self.max_bytes // 4:
+            self._store(key, generation, result, size)
+        return result
+
+    # Collects the rows one at a time while they are read from the database,
+    # see set()
+    def collector(self):
+        return _Collector(self.max_bytes // 4) if self.max_bytes else None
+
+    def set(self, key, generation, collector):
+        if collector.rows is None:
+            return
+        result = (collector.column_names, collector.rows)
+        with self._lock:
+            self._store(key, generation, result, collector.size)
+            self._write(key, generation, result, collector.size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, key, generation, result, size):
+        if key in self._entries:
+            self.size -= self._entries[key][2]
+        self._entries[key] = [generation, result, size, self._tick()]
+        self.size += size
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    # Evicts the least recently used entries until three quarters of the
+    # limit are left, like IdCache
+    def _evict(self):
+        entries = sorted(self._entries.items(), key=lambda item: item[1][3])
+        for key, entry in entries:
+            if self.size <= self.max_bytes * 3 // 4:
+                break
+            del self._entries[key]
+            self.size -= entry[2]
+
+    def _size_of(self, rows):
+        collector = _Collector(None)
+        for row in rows:
+            collector.add(row)
+        return collector.size
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + '.cache')
+
+    def _read(self, key, generation):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'rb') as source:
+                stored_key, stored_generation, result = pickle.load(source)
+        except (EnvironmentError, EOFError, pickle.UnpicklingError):
+            return None
+        if (stored_key, stored_generation) != (key, generation):
+            return None
+        os.utime(self._path(key), None)
+        return result
+
+    # The entry is written into a temporary file and renamed, so that the
+    # other processes never read a partly written one. The least recently
+    # used files are removed once the directory exceeds its limit.
+    def _write(self, key, generation, result, size):
+        if not self.directory or size > self.max_disk_bytes // 4:
+            return
+        path = self._path(key)
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'wb') as output:
+            pickle.dump((key, generation, result), output, pickle.HIGHEST_PROTOCOL)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary, path)
+        self._evict_files()
+
+    def _evict_files(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class _Collector(object):
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self.column_names = None
+        self.rows = []
+        self.size = 0
+
+    def add(self, row):
+        if self.rows is None:
+            return
+        self.size += ROW_BYTES + sum(VALUE_BYTES + len(value) if isinstance(value, basestring)
+                                     else VALUE_BYTES for value in row)
+        if self._max_size is not None and self.size > self._max_size:
+            self.rows = None
+        else:
+            self.rows.append(tuple(row))
+
+
+# Cached rows are read like sqlite3.Row objects, by index or column name
+class CachedRow(tuple):
+
+    def __new__(cls, values, column_indexes):
+        row = tuple.__new__(cls, values)
+        row._column_indexes = column_indexes
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            key = self._column_indexes[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return sorted(self._column_indexes, key=self._column_indexes.get)
@@ -12,5 +12,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 from .database_writer import DatabaseWriter
+from .keyword_filter import KeywordFilter
+from .parallel_importer import ParallelImporter
+from .partitioned_database_writer import PartitionError, PartitionedDatabaseWriter
 from .reader_options import ReaderOptions
 from .robot_results_parser import RobotResultsParser
+from .source_file_filter import SourceFileFilter
+from .spool_directory import ImportStatus, SpoolDirectory
+from .streaming_results_parser import StreamingResultsParser
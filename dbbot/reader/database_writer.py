@@ -11,17 +11,74 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-from dbbot import RobotDatabase
+from __future__ import with_statement
+import zlib
+from contextlib import contextmanager
+from hashlib import sha1
+from sqlite3 import Binary, IntegrityError
 
+from dbbot import Metrics, RobotDatabase
+from dbbot.robot_database import UNCOMPRESSED, ZLIB_COMPRESSED
+
+from .id_cache import IdCache
+
+
+DEFAULT_ID_CACHE_SIZE = 100000
+DEFAULT_BATCH_SIZE = 5000
+STRING_CACHE_SIZE = 100000
+# SQLite allows at most 999 parameters in a statement
+MAX_PARAMETERS = 999
+# Version of the schema of new databases. Existing ones are brought up to it
+# with the migrations of dbbot.migrate.
+SCHEMA_VERSION = 1
+
+# Rollup tables as (name, status table, key column, referenced table). Each
+# has a row per suite, test or keyword with totals over all the test runs.
+ROLLUPS = (
+    ('suite_rollups', 'suite_status', 'suite_id', 'suites'),
+    ('test_rollups', 'test_status', 'test_id', 'tests'),
+    ('keyword_rollups', 'keyword_status', 'keyword_id', 'keywords')
+)
 
 class DatabaseWriter(RobotDatabase):
+    # Buffered rows are flushed once their estimated text size exceeds this
+    max_buffered_bytes = 16 * 1024 * 1024
 
-    def __init__(self, db_file_path, verbose_stream):
+    def __init__(self, db_file_path, verbose_stream, id_cache_size=DEFAULT_ID_CACHE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, metrics=None, epoch_timestamps=False,
+                 compress_threshold=None):
         super(DatabaseWriter, self).__init__(db_file_path, verbose_stream)
+        self._metrics = metrics or Metrics(enabled=False)
+        self._epoch_timestamps = epoch_timestamps
+        self._compress_threshold = compress_threshold
+        self._unique_columns = {}
+        self._text_columns = {}
+        self._id_cache = IdCache(id_cache_size)
+        self._string_ids = IdCache(STRING_CACHE_SIZE)
+        self._interned_tables = {}
+        self._batch_size = batch_size
+        self._buffers = {}
+        self._buffered_bytes = 0
         self._init_schema()
 
+    @property
+    def unique_columns(self):
+        return dict(self._unique_columns)
+
+    @property
+    def epoch_timestamps(self):
+        return self._epoch_timestamps
+
+    @property
+    def interns_strings(self):
+        return bool(self._interned_tables)
+
     def _init_schema(self):
         self._verbose('- Initializing database schema')
+        new_database = not self._table_exists('test_runs')
+        # The timestamp format is chosen when the database is created
+        if not new_database:
+            self._epoch_timestamps = self._column_type('test_runs', 'imported_at') == 'INTEGER'
         self._create_table_test_runs()
         self._create_table_test_run_status()
         self._create_table_test_run_errors()
@@ -35,14 +92,35 @@ class DatabaseWriter(RobotDatabase):
         self._create_table_messages()
         self._create_table_tags()
         self._create_table_arguments()
+        self._create_table_source_files()
+        self._create_rollup_tables()
+        self._create_table_schema_version()
+        # Indexes of existing databases are managed with dbbot.index
+        if new_database:
+            self.set_schema_version(SCHEMA_VERSION)
+            self.create_indexes()
+
+    def _table_exists(self, table_name):
+        sql_statement = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
+        return self._connection.execute(sql_statement, [table_name]).fetchone() is not None
+
+    def _column_type(self, table_name, column_name):
+        for column in self._connection.execute('PRAGMA table_info(%s)' % table_name):
+            if column[1] == column_name:
+                return column[2]
+        return None
+
+    @property
+    def _timestamp_type(self):
+        return 'INTEGER' if self._epoch_timestamps else 'DATETIME'
 
     def _create_table_test_runs(self):
         self._create_table('test_runs', {
             'hash': 'TEXT NOT NULL',
-            'imported_at': 'DATETIME NOT NULL',
+            'imported_at': '%s NOT NULL' % self._timestamp_type,
             'source_file': 'TEXT',
-            'started_at': 'DATETIME',
-            'finished_at': 'DATETIME',
+            'started_at': self._timestamp_type,
+            'finished_at': self._timestamp_type,
         }, ('hash',))
 
     def _create_table_test_run_status(self):
@@ -58,7 +136,7 @@ class DatabaseWriter(RobotDatabase):
         self._create_table('test_run_errors', {
             'test_run_id': 'INTEGER NOT NULL REFERENCES test_runs',
             'level': 'TEXT NOT NULL',
-            'timestamp': 'DATETIME NOT NULL',
+            'timestamp': '%s NOT NULL' % self._timestamp_type,
             'content': 'TEXT NOT NULL'
         }, ('test_run_id', 'level', 'content'))
 
@@ -128,10 +206,10 @@ class DatabaseWriter(RobotDatabase):
         })
 
     def _create_table_messages(self):
-        self._create_table('messages', {
+        self._create_interned_table('messages', {
             'keyword_id': 'INTEGER NOT NULL REFERENCES keywords',
             'level': 'TEXT NOT NULL',
-            'timestamp': 'DATETIME NOT NULL',
+            'timestamp': '%s NOT NULL' % self._timestamp_type,
             'content': 'TEXT NOT NULL'
         }, ('keyword_id', 'level', 'content'))
 
@@ -142,16 +220,104 @@ class DatabaseWriter(RobotDatabase):
         }, ('test_id', 'content'))
 
     def _create_table_arguments(self):
-        self._create_table('arguments', {
+        self._create_interned_table('arguments', {
             'keyword_id': 'INTEGER NOT NULL REFERENCES keywords',
             'content': 'TEXT NOT NULL'
         }, ('keyword_id', 'content'))
 
+    def _create_table_source_files(self):
+        self._create_table('source_files', {
+            'path': 'TEXT NOT NULL',
+            'size': 'INTEGER NOT NULL',
+            'modified_at': 'REAL NOT NULL',
+            'hash': 'TEXT NOT NULL'
+        }, ('path', 'size', 'modified_at'))
+
+    def _create_rollup_tables(self):
+        for rollup_name, _, key_column, referenced_table_name in ROLLUPS:
+            self._create_table(rollup_name, {
+                key_column: 'INTEGER NOT NULL REFERENCES %s' % referenced_table_name,
+                'runs': 'INTEGER NOT NULL',
+                'failed': 'INTEGER NOT NULL',
+                'elapsed_total': 'INTEGER NOT NULL',
+                'elapsed_min': 'INTEGER NOT NULL',
+                'elapsed_max': 'INTEGER NOT NULL',
+                'last_test_run_id': 'INTEGER NOT NULL REFERENCES test_runs',
+                'last_failed_test_run_id': 'INTEGER REFERENCES test_runs'
+            }, (key_column,))
+        self._create_table('rollup_progress', {
+            'name': 'TEXT NOT NULL',
+            'last_status_id': 'INTEGER NOT NULL'
+        }, ('name',))
+
+    def _create_table_schema_version(self):
+        self._create_table('schema_version', {
+            'version': 'INTEGER NOT NULL',
+            'applied_at': 'DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP'
+        }, ('version',))
+
+    def set_schema_version(self, version):
+        self._execute('schema_version', 'INSERT OR IGNORE INTO schema_version (version) '
+                      'VALUES (?)', [version])
+
+    # Creates a table with the columns and constraints of a definition given
+    # by table_definition(), e.g. of another database
+    def create_table_like(self, table_name, table_definition):
+        sql_statement = 'CREATE TABLE %s %s' % (table_name,
+                                                table_definition[table_definition.index('('):])
+        self._connection.execute(sql_statement)
+
+    def _create_table_strings(self):
+        self._create_table('strings', {
+            'hash': 'BLOB NOT NULL',
+            'content': 'TEXT NOT NULL',
+            'compressed': 'INTEGER NOT NULL DEFAULT %d' % UNCOMPRESSED
+        }, ('hash',))
+        if self._column_type('strings', 'compressed') is None:
+            self._connection.execute('ALTER TABLE strings ADD COLUMN compressed INTEGER NOT NULL '
+                                     'DEFAULT %d' % UNCOMPRESSED)
+
+    # Message and argument texts repeat across keywords and test runs, so they
+    # are stored once in the strings table and referenced by id. A view with
+    # the original name and columns joins the texts back for queries.
+    # Databases created before this keep the plain table.
+    def _create_interned_table(self, table_name, columns, unique_columns):
+        if self._table_exists(table_name):
+            self._create_table(table_name, columns, unique_columns)
+            return
+        self._create_table_strings()
+        interned_table_name = 'interned_' + table_name
+        interned_columns = dict(columns)
+        interned_columns['content_id'] = 'INTEGER NOT NULL REFERENCES strings'
+        del interned_columns['content']
+        self._create_table(interned_table_name, interned_columns,
+            tuple('content_id' if name == 'content' else name for name in unique_columns)
+        )
+        self._text_columns[table_name] = tuple(column_name for column_name, properties
+                                               in columns.items() if properties.startswith('TEXT'))
+        self._interned_tables[table_name] = interned_table_name
+        view_columns = ['%s.id AS id' % interned_table_name]
+        for column_name in columns:
+            if column_name == 'content':
+                view_columns.append('strings.content AS content')
+            else:
+                view_columns.append('%s.%s AS %s' % (interned_table_name, column_name, column_name))
+        sql_statement = 'CREATE VIEW IF NOT EXISTS %s AS SELECT %s FROM %s JOIN strings ON strings.id=%s.content_id' % (
+            table_name,
+            ', '.join(view_columns),
+            interned_table_name,
+            interned_table_name
+        )
+        self._connection.execute(sql_statement)
+
     def _create_table(self, table_name, columns, unique_columns=()):
         definitions = ['id INTEGER PRIMARY KEY']
         for column_name, properties in columns.items():
             definitions.append('%s %s' % (column_name, properties))
+        self._text_columns[table_name] = tuple(column_name for column_name, properties
+                                               in columns.items() if properties.startswith('TEXT'))
         if unique_columns:
+            self._unique_columns[table_name] = unique_columns
             unique_column_names = ', '.join(unique_columns)
             definitions.append('CONSTRAINT unique_%s UNIQUE (%s)' % (
                 table_name, unique_column_names)
@@ -159,45 +325,263 @@ class DatabaseWriter(RobotDatabase):
         sql_statement = 'CREATE TABLE IF NOT EXISTS %s (%s)' % (table_name, ', '.join(definitions))
         self._connection.execute(sql_statement)
 
+    # Buffered rows are written first, so that they are indexed as well
+    def create_indexes(self, table_names=None):
+        self.flush()
+        super(DatabaseWriter, self).create_indexes(table_names)
+
+    def analyze(self):
+        self.flush()
+        self._verbose('- Analyzing database')
+        self._connection.execute('ANALYZE')
+
+    # Newer SQLite versions would also rename the FOREIGN KEY references of
+    # the other tables, which are meant for whatever table has the name.
+    # Older ones do not know the pragma and return no setting to restore.
     def rename_table(self, old_name, new_name):
-        sql_statement = 'ALTER TABLE %s RENAME TO %s' % (old_name, new_name)
-        self._connection.execute(sql_statement)
+        self._flush(old_name)
+        setting = self._connection.execute('PRAGMA legacy_alter_table').fetchone()
+        self._set_pragma('legacy_alter_table', 'ON')
+        try:
+            sql_statement = 'ALTER TABLE %s RENAME TO %s' % (old_name, new_name)
+            self._connection.execute(sql_statement)
+        finally:
+            self._set_pragma('legacy_alter_table', setting[0] if setting else 'OFF')
 
     def drop_table(self, table_name):
+        self._flush(table_name)
         sql_statement = 'DROP TABLE %s' % table_name
         self._connection.execute(sql_statement)
 
-    def copy_table(self, from_table, to_table, columns_to_copy):
-        column_names = ', '.join(columns_to_copy)
+    # With id_range, only the rows with ids from its first to its last one
+    # are copied, so that large tables can be copied in chunks. expressions
+    # give the values of columns that the source table does not have.
+    def copy_table(self, from_table, to_table, columns_to_copy, id_range=None,
+                   expressions={}):
+        self._flush(from_table)
+        self._flush(to_table)
+        column_names = list(columns_to_copy) + sorted(expressions)
+        values = list(columns_to_copy) + [expressions[name] for name in sorted(expressions)]
         sql_statement = 'INSERT INTO %s(%s) SELECT %s FROM %s' % (
             to_table,
-            column_names,
-            column_names,
+            ', '.join(column_names),
+            ', '.join(values),
             from_table
         )
-        self._connection.execute(sql_statement)
+        if id_range is None:
+            return self._connection.execute(sql_statement).rowcount
+        sql_statement += ' WHERE id BETWEEN ? AND ?'
+        return self._connection.execute(sql_statement, id_range).rowcount
+
+    # The sqlite3 module commits before schema changes, so changes that have
+    # to be made all or nothing, such as replacing a table, are made in an
+    # explicit transaction
+    @contextmanager
+    def transaction(self):
+        self.commit()
+        isolation_level = self._connection.isolation_level
+        self._connection.isolation_level = None
+        try:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+                self.flush()
+            except:
+                self._connection.execute('ROLLBACK')
+                self.rollback()
+                raise
+            self._connection.execute('COMMIT')
+        finally:
+            self._connection.isolation_level = isolation_level
 
     def fetch_id(self, table_name, criteria):
+        self._flush(table_name)
         sql_statement = 'SELECT id FROM %s WHERE ' % table_name
         sql_statement += ' AND '.join('%s=?' % key for key in criteria.keys())
-        res = self._connection.execute(sql_statement, criteria.values()).fetchone()
+        res = self._execute(table_name, sql_statement, criteria.values()).fetchone()
         if not res:
             raise Exception('Query did not yield id, even though it should have.'
                             '\nSQL statement was:\n%s\nArguments were:\n%s' % (sql_statement, criteria.values()))
         return res[0]
 
+    def test_run_imported(self, hash):
+        sql_statement = 'SELECT 1 FROM test_runs WHERE hash=?'
+        return self._execute('test_runs', sql_statement, [hash]).fetchone() is not None
+
+    def source_file_imported(self, path, size, modified_at):
+        self._flush('source_files')
+        sql_statement = ('SELECT 1 FROM source_files JOIN test_runs ON test_runs.hash=source_files.hash '
+                         'WHERE path=? AND size=? AND modified_at=?')
+        return self._execute('source_files', sql_statement,
+                             [path, size, modified_at]).fetchone() is not None
+
+    def insert_or_fetch_id(self, table_name, values):
+        key_columns = self._unique_columns[table_name]
+        key = (table_name,) + tuple(values[column] for column in key_columns)
+        # NULLs never collide in UNIQUE constraints, so such rows are not cached
+        cacheable = None not in key
+        row_id = self._id_cache.get(key) if cacheable else None
+        if row_id is not None:
+            return row_id, False
+        try:
+            row_id, inserted = self.insert(table_name, values), True
+        except IntegrityError:
+            self._metrics.count('integrity_error_fallbacks.%s' % table_name)
+            row_id, inserted = self.fetch_id(table_name,
+                dict((column, values[column]) for column in key_columns)
+            ), False
+        if cacheable:
+            self._id_cache.set(key, row_id)
+        return row_id, inserted
+
+    def preload_ids(self, table_names=('suites', 'tests', 'keywords')):
+        self._verbose('- Preloading ids of %s' % ', '.join(table_names))
+        for table_name in table_names:
+            key_columns = self._unique_columns[table_name]
+            sql_statement = 'SELECT id, %s FROM %s ORDER BY id DESC LIMIT ?' % (
+                ', '.join(key_columns), table_name)
+            rows = self._connection.execute(sql_statement, [self._id_cache.max_size]).fetchall()
+            for row in reversed(rows):
+                key = (table_name,) + tuple(row[1:])
+                if None not in key:
+                    self._id_cache.set(key, row[0])
+
     def insert(self, table_name, criteria):
+        self._flush(table_name)
         sql_statement = self._format_insert_statement(table_name, criteria.keys())
-        cursor = self._connection.execute(sql_statement, criteria.values())
+        cursor = self._execute(table_name, sql_statement, criteria.values())
         return cursor.lastrowid
 
     def insert_or_ignore(self, table_name, criteria):
-        sql_statement = self._format_insert_statement(table_name, criteria.keys(), 'IGNORE')
-        self._connection.execute(sql_statement, criteria.values())
+        self._buffer(table_name, tuple(criteria.keys()), [tuple(criteria.values())])
 
     def insert_many_or_ignore(self, table_name, column_names, values):
-        sql_statement = self._format_insert_statement(table_name, column_names, 'IGNORE')
-        self._connection.executemany(sql_statement, values)
+        if values:
+            self._buffer(table_name, tuple(column_names), values)
+
+    # Rows inserted with OR IGNORE are never referenced by other rows, so they
+    # can wait in per-table buffers. Every statement that reads or modifies a
+    # table flushes that table first, which keeps the outcome identical to
+    # executing the inserts immediately.
+    def _buffer(self, table_name, column_names, rows):
+        buffer = self._buffers.get(table_name)
+        if buffer is None or buffer.column_names != column_names:
+            self._flush(table_name)
+            buffer = self._buffers[table_name] = _RowBuffer(
+                column_names, self._text_columns.get(table_name, ()))
+        self._buffered_bytes += buffer.extend(rows)
+        if len(buffer.rows) >= self._batch_size:
+            self._flush(table_name)
+        elif self._buffered_bytes >= self.max_buffered_bytes:
+            self.flush()
+
+    def _flush(self, table_name):
+        buffer = self._buffers.pop(table_name, None)
+        if buffer:
+            column_names, rows = buffer.column_names, buffer.rows
+            if table_name in self._interned_tables:
+                table_name, column_names, rows = self._intern(table_name, column_names, rows)
+            sql_statement = self._format_insert_statement(table_name, column_names, 'IGNORE')
+            self._executemany(table_name, sql_statement, rows)
+            self._buffered_bytes -= buffer.size
+
+    def _intern(self, table_name, column_names, rows):
+        index = column_names.index('content')
+        string_ids = self._fetch_string_ids(set(row[index] for row in rows))
+        interned_rows = []
+        for row in rows:
+            row = list(row)
+            row[index] = string_ids[row[index]]
+            interned_rows.append(row)
+        column_names = column_names[:index] + ('content_id',) + column_names[index + 1:]
+        return self._interned_tables[table_name], column_names, interned_rows
+
+    # Texts not in the cache are inserted and then looked up by their hash,
+    # a batch of them at a time
+    def _fetch_string_ids(self, contents):
+        string_ids = {}
+        hashes = {}
+        for content in contents:
+            string_id = self._string_ids.get(content)
+            if string_id is None:
+                hashes[self._hash_string(content)] = content
+            else:
+                string_ids[content] = string_id
+        if not hashes:
+            return string_ids
+        self._executemany('strings',
+            'INSERT OR IGNORE INTO strings (hash, content, compressed) VALUES (?,?,?)',
+            [(Binary(hash),) + self._compress(content) for hash, content in hashes.items()]
+        )
+        missing = list(hashes)
+        for start in range(0, len(missing), MAX_PARAMETERS):
+            chunk = missing[start:start + MAX_PARAMETERS]
+            sql_statement = 'SELECT id, hash FROM strings WHERE hash IN (%s)' % ','.join('?' * len(chunk))
+            for string_id, hash in self._execute('strings', sql_statement, [Binary(hash) for hash in chunk]):
+                content = hashes[str(hash)]
+                string_ids[content] = string_id
+                self._string_ids.set(content, string_id)
+        return string_ids
+
+    def _hash_string(self, content):
+        return sha1(self._encode(content)).digest()
+
+    # Texts of at least the threshold size are stored compressed, unless
+    # compressing does not make them smaller
+    def _compress(self, content):
+        if self._compress_threshold is None:
+            return content, UNCOMPRESSED
+        encoded = self._encode(content)
+        if len(encoded) < self._compress_threshold:
+            return content, UNCOMPRESSED
+        compressed = zlib.compress(encoded)
+        if len(compressed) >= len(encoded):
+            return content, UNCOMPRESSED
+        self._metrics.count('compressed_strings')
+        return Binary(compressed), ZLIB_COMPRESSED
+
+    def _encode(self, content):
+        if isinstance(content, unicode):
+            return content.encode('utf-8')
+        return content
+
+    def flush(self):
+        for table_name in list(self._buffers):
+            self._flush(table_name)
+
+    def update(self, table_name, row_id, values):
+        self._flush(table_name)
+        sql_statement = 'UPDATE %s SET %s WHERE id=?' % (
+            table_name,
+            ','.join('%s=?' % key for key in values.keys())
+        )
+        self._execute(table_name, sql_statement, list(values.values()) + [row_id])
+
+    def fail_test_statuses(self, test_run_id, suite_ids):
+        self._flush('test_status')
+        sql_statement = ("UPDATE test_status SET status='FAIL' WHERE test_run_id=? AND "
+                         "test_id IN (SELECT id FROM tests WHERE suite_id=?)")
+        self._executemany('test_status', sql_statement,
+            [(test_run_id, suite_id) for suite_id in suite_ids]
+        )
+
+    def fail_suite_statuses(self, test_run_id, suite_ids):
+        self._flush('suite_status')
+        sql_statement = ("UPDATE suite_status SET failed=failed+passed, passed=0, "
+                         "status=CASE WHEN failed+passed > 0 THEN 'FAIL' ELSE status END "
+                         "WHERE test_run_id=? AND suite_id=?")
+        self._executemany('suite_status', sql_statement,
+            [(test_run_id, suite_id) for suite_id in suite_ids]
+        )
+
+    def _execute(self, table_name, sql_statement, parameters):
+        self._metrics.count('sql_statements.%s' % table_name)
+        return self._connection.execute(sql_statement, parameters)
+
+    def _executemany(self, table_name, sql_statement, rows):
+        self._metrics.count('sql_statements.%s' % table_name)
+        self._metrics.count('sql_rows.%s' % table_name, len(rows))
+        return self._connection.executemany(sql_statement, rows)
 
     def _format_insert_statement(self, table_name, column_names, on_conflict='ABORT'):
         return 'INSERT OR %s INTO %s (%s) VALUES (%s)' % (
@@ -207,7 +591,82 @@ class DatabaseWriter(RobotDatabase):
             ','.join('?' * len(column_names))
         )
 
+    # Adds the status rows written since the previous update into the rollup
+    # tables. Status ids only grow, so the rows are found by the last id
+    # already rolled up, which also fills the rollups of databases created
+    # before them on their first update. Statuses may be changed until the
+    # test run has been imported, so this is done before commits only.
+    def update_rollups(self):
+        with self._metrics.timer('update_rollups'):
+            for rollup_name, status_table_name, key_column, _ in ROLLUPS:
+                self._update_rollup(rollup_name, status_table_name, key_column)
+
+    def _update_rollup(self, rollup_name, status_table_name, key_column):
+        self._flush(status_table_name)
+        row = self._execute('rollup_progress', 'SELECT last_status_id FROM rollup_progress '
+                            'WHERE name=?', [rollup_name]).fetchone()
+        last_status_id = row[0] if row else 0
+        sql_statement = ("SELECT %s, count(), sum(status='FAIL'), sum(elapsed), min(elapsed), "
+                         "max(elapsed), max(test_run_id), max(CASE WHEN status='FAIL' "
+                         "THEN test_run_id END), max(id) FROM %s WHERE id>? GROUP BY %s" % (
+                         key_column, status_table_name, key_column))
+        rows = self._execute(status_table_name, sql_statement, [last_status_id]).fetchall()
+        if not rows:
+            return
+        self._verbose('- Updating %s of %d items' % (rollup_name, len(rows)))
+        # Rows of new items are not updated but inserted after the update
+        self._executemany(rollup_name, 'UPDATE %s SET runs=runs+?, failed=failed+?, '
+                          'elapsed_total=elapsed_total+?, elapsed_min=min(elapsed_min, ?), '
+                          'elapsed_max=max(elapsed_max, ?), '
+                          'last_test_run_id=max(last_test_run_id, ?), '
+                          'last_failed_test_run_id=nullif(max(ifnull(last_failed_test_run_id, 0), '
+                          'ifnull(?, 0)), 0) WHERE %s=?' % (rollup_name, key_column),
+                          [row[1:8] + row[:1] for row in rows])
+        self._executemany(rollup_name, self._format_insert_statement(rollup_name, (
+            key_column, 'runs', 'failed', 'elapsed_total', 'elapsed_min', 'elapsed_max',
+            'last_test_run_id', 'last_failed_test_run_id'), 'IGNORE'), [row[:8] for row in rows])
+        self._execute('rollup_progress', 'INSERT OR REPLACE INTO rollup_progress '
+                      '(name, last_status_id) VALUES (?, ?)',
+                      [rollup_name, max(row[8] for row in rows)])
+
     def commit(self):
+        self.flush()
+        self.update_rollups()
         self._verbose('- Committing changes into database')
-        self._connection.commit()
+        with self._metrics.timer('commit'):
+            self._connection.commit()
+
+    # Cached ids may point to rows that are rolled back, so the cache is
+    # emptied as well
+    def rollback(self):
+        self._buffers.clear()
+        self._buffered_bytes = 0
+        self._id_cache.clear()
+        self._string_ids.clear()
+        self._verbose('- Rolling back uncommitted changes')
+        self._connection.rollback()
+
+    def close(self):
+        self._verbose('- ID cache: %d hits, %d misses, %d cached' % (
+            self._id_cache.hits, self._id_cache.misses, len(self._id_cache)))
+        self._metrics.count('id_cache_hits', self._id_cache.hits)
+        self._metrics.count('id_cache_misses', self._id_cache.misses)
+        super(DatabaseWriter, self).close()
+
+
+class _RowBuffer(object):
+
+    def __init__(self, column_names, text_columns):
+        self.column_names = column_names
+        self.rows = []
+        self.size = 0
+        self._text_indexes = [index for index, column_name in enumerate(column_names)
+                              if column_name in text_columns]
 
+    def extend(self, rows):
+        self.rows.extend(rows)
+        size = 0
+        for index in self._text_indexes:
+            size += sum(len(row[index] or '') for row in rows)
+        self.size += size
+        return size
@@ -0,0 +1,59 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import mmap
+from hashlib import sha1
+
+
+BLOCK_SIZE = 1024 * 1024
+
+# Read-only file object that computes the SHA1 of everything read through
+# it, so the parser and the hash share a single pass over the file.
+class HashingReader(object):
+
+    def __init__(self, path, use_mmap=False):
+        self.name = path
+        self._file = open(path, 'rb')
+        self._mapped = self._map(self._file) if use_mmap else None
+        self._source = self._file if self._mapped is None else self._mapped
+        self._hasher = sha1()
+
+    def _map(self, opened):
+        try:
+            return mmap.mmap(opened.fileno(), 0, access=mmap.ACCESS_READ)
+        # Empty files cannot be mapped
+        except (ValueError, EnvironmentError):
+            return None
+
+    def read(self, size=-1):
+        if size < 0 and self._mapped is not None:
+            size = len(self._mapped)
+        data = self._source.read(size)
+        self._hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        while self.read(BLOCK_SIZE):
+            pass
+        return self._hasher.hexdigest()
+
+    def close(self):
+        if self._mapped is not None:
+            self._mapped.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        self.close()
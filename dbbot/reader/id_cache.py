@@ -0,0 +1,54 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+class IdCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._clock = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry[1] = self._tick()
+        return entry[0]
+
+    def set(self, key, row_id):
+        if not self.max_size:
+            return
+        self._entries[key] = [row_id, self._tick()]
+        if len(self._entries) > self.max_size:
+            self._evict()
+
+    def clear(self):
+        self._entries.clear()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    # Evicting the least recently used quarter at once keeps lookups O(1)
+    # without a linked list, which Python 2.6 does not offer out of the box.
+    def _evict(self):
+        entries = sorted(self._entries.items(), key=lambda item: item[1][1])
+        for key, _ in entries[:len(entries) - self.max_size * 3 // 4]:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
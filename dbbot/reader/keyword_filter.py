@@ -0,0 +1,75 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from itertools import islice
+
+
+# HTML messages are logged on the INFO level
+MESSAGE_LEVELS = {
+    'TRACE': 0,
+    'DEBUG': 1,
+    'INFO': 2,
+    'HTML': 2,
+    'WARN': 3,
+    'ERROR': 4,
+    'FAIL': 5
+}
+
+# Decides which keywords and messages the parsers store when keywords are
+# included. Depths start from 1 for the keywords of suites and tests.
+# Without failed_only the status of a keyword is not needed, so the
+# streaming parser can decide before the keyword has been read.
+class KeywordFilter(object):
+
+    def __init__(self, max_depth=None, failed_only=False, message_level=None, max_messages=None):
+        self._max_depth = max_depth
+        self.failed_only = failed_only
+        self._min_level = MESSAGE_LEVELS[message_level] if message_level else None
+        self._max_messages = max_messages
+
+    @property
+    def caps_messages(self):
+        return self._max_messages is not None
+
+    def includes(self, status, depth):
+        if self._max_depth is not None and depth > self._max_depth:
+            return False
+        return not self.failed_only or status == 'FAIL'
+
+    # Messages of unknown levels are kept
+    def includes_message(self, level):
+        return self._min_level is None or MESSAGE_LEVELS.get(level, self._min_level) >= self._min_level
+
+    def messages(self, messages):
+        if self._min_level is None:
+            return messages
+        return [message for message in messages if self.includes_message(message.level)]
+
+    def message_cap(self):
+        return _MessageCap(self._max_messages)
+
+
+# Messages of a test, or of the setup and teardown of a suite, are counted
+# against one cap in the order their keywords end, i.e. the messages of
+# child keywords before those of their parent.
+class _MessageCap(object):
+
+    def __init__(self, max_messages):
+        self._left = max_messages
+
+    def take(self, messages):
+        if self._left is None:
+            return messages
+        messages = list(islice(messages, self._left))
+        self._left -= len(messages)
+        return messages
@@ -0,0 +1,330 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import sys
+import threading
+import traceback
+from collections import deque
+from Queue import Empty, Full, Queue
+
+from dbbot import Logger, Metrics
+
+from .robot_imports import data_error
+
+
+# Batches a worker may have waiting for the writer before it blocks
+QUEUE_SIZE = 8
+
+ID_COLUMNS = ('test_run_id', 'suite_id', 'test_id', 'keyword_id')
+
+class ParallelImporter(object):
+
+    def __init__(self, parser_class, include_keywords, db, verbose_stream, jobs, batch_size,
+                 use_mmap=False, metrics=None, keyword_filter=None, threaded=False):
+        self._parser_class = parser_class
+        self._include_keywords = include_keywords
+        self._keyword_filter = keyword_filter
+        self._use_mmap = use_mmap
+        self._db = db
+        self._be_verbose = verbose_stream is not None
+        self._jobs = jobs
+        self._worker_class = _ThreadWorker if threaded else _Worker
+        self._batch_size = batch_size
+        self._verbose = Logger('Importer', verbose_stream)
+        self._metrics = metrics or Metrics(enabled=False)
+        self._ids = {}
+        self._inserted = set()
+        self._skipping = False
+
+    # Files are parsed in worker processes, or with threaded in a worker
+    # thread, but written here in the given order, so ids and contents match
+    # a sequential import. Yields each file with the DataError its parsing
+    # failed with, if any. The next worker is started before yielding, so
+    # that it parses while the caller commits.
+    def import_files(self, xml_files):
+        pending = iter(xml_files)
+        workers = deque()
+        try:
+            self._start_workers(pending, workers)
+            while workers:
+                worker = workers[0]
+                try:
+                    self.write(worker.xml_file, worker.batches())
+                except data_error() as error:
+                    workers.popleft()
+                    self._start_workers(pending, workers)
+                    yield worker.xml_file, error
+                else:
+                    self._metrics.merge(worker.metrics)
+                    workers.popleft()
+                    self._start_workers(pending, workers)
+                    yield worker.xml_file, None
+        finally:
+            for worker in workers:
+                worker.terminate()
+
+    # Files are taken from the iterable only when a worker is free for them
+    def _start_workers(self, pending, workers):
+        while len(workers) < self._jobs:
+            xml_file = next(pending, None)
+            if xml_file is None:
+                break
+            workers.append(self._start_worker(xml_file))
+
+    def _start_worker(self, xml_file):
+        self._verbose('- Starting worker for "%s"' % xml_file)
+        return self._worker_class(xml_file, self._parser_class, self._include_keywords,
+                                  self._keyword_filter, self._use_mmap, self._db.unique_columns,
+                                  self._db.epoch_timestamps, self._batch_size, self._be_verbose,
+                                  self._metrics.enabled)
+
+    # Applies the batches a RowRecorder produced from one file
+    def write(self, xml_file, batches):
+        self._verbose('- Writing results parsed from "%s"' % xml_file)
+        self._ids = {None: None}
+        self._inserted = set()
+        self._skipping = False
+        with self._metrics.timer('write'):
+            for batch in batches:
+                for operation in batch:
+                    if self._skipping:
+                        break
+                    getattr(self, '_' + operation[0])(*operation[1:])
+        if self._skipping:
+            self._verbose('- Skipped %s, test run has already been imported' % xml_file)
+            self._metrics.count('test_runs_skipped')
+
+    def _insert_or_fetch_id(self, table_name, column_names, values, ref):
+        indexes = self._id_indexes(column_names)
+        row_id, inserted = self._db.insert_or_fetch_id(
+            table_name, dict(zip(column_names, self._resolve(values, indexes))))
+        self._ids[ref] = row_id
+        if inserted:
+            self._inserted.add(ref)
+        # Workers cannot see the database, so they parse already imported
+        # files in full. The rows are dropped here like the parsers would.
+        elif table_name == 'test_runs':
+            self._skipping = True
+
+    def _insert_many_or_ignore(self, table_name, column_names, rows):
+        indexes = self._id_indexes(column_names)
+        if indexes:
+            rows = [self._resolve(row, indexes) for row in rows]
+        self._db.insert_many_or_ignore(table_name, column_names, rows)
+
+    # The parsers only update rows they inserted themselves. Workers cannot
+    # know whether a row already exists, so the check is repeated here.
+    def _update(self, table_name, ref, values):
+        if ref in self._inserted:
+            self._db.update(table_name, self._ids[ref], values)
+
+    def _fail_test_statuses(self, test_run_ref, suite_refs):
+        self._db.fail_test_statuses(self._ids[test_run_ref], [self._ids[ref] for ref in suite_refs])
+
+    def _fail_suite_statuses(self, test_run_ref, suite_refs):
+        self._db.fail_suite_statuses(self._ids[test_run_ref], [self._ids[ref] for ref in suite_refs])
+
+    def _id_indexes(self, column_names):
+        return [index for index, name in enumerate(column_names) if name in ID_COLUMNS]
+
+    def _resolve(self, row, indexes):
+        row = list(row)
+        for index in indexes:
+            row[index] = self._ids[row[index]]
+        return row
+
+
+class _Worker(object):
+
+    def __init__(self, xml_file, *parser_args):
+        self.xml_file = xml_file
+        self.metrics = None
+        self._queue = self._create_queue()
+        self._process = self._create_process((xml_file,) + parser_args + (self._queue,))
+        self._process.daemon = True
+        self._process.start()
+
+    def _create_queue(self):
+        from multiprocessing import Queue
+        return Queue(QUEUE_SIZE)
+
+    def _create_process(self, args):
+        from multiprocessing import Process
+        return Process(target=_parse_file, args=args)
+
+    def batches(self):
+        while True:
+            message = self._receive()
+            if message[0] == 'batch':
+                yield message[1]
+                continue
+            self._process.join()
+            if message[0] == 'error':
+                raise message[1]
+            if message[0] == 'failed':
+                raise RuntimeError('Parsing "%s" failed in a worker process:\n%s'
+                                   % (self.xml_file, message[1]))
+            self.metrics = message[1]
+            return
+
+    def _receive(self):
+        while True:
+            try:
+                return self._queue.get(timeout=1)
+            except Empty:
+                if not self._process.is_alive():
+                    break
+        # The last message may arrive just after the process has exited
+        try:
+            return self._queue.get(timeout=1)
+        except Empty:
+            raise RuntimeError('Worker process parsing "%s" exited with code %s'
+                               % (self.xml_file, self._process.exitcode))
+
+    def terminate(self):
+        self._process.terminate()
+
+
+# Parses in a thread of this process instead. The thread and the writer
+# take turns under the GIL, but parsing goes on while SQLite does I/O. A
+# thread cannot be killed, so terminating makes its next put fail instead.
+class _ThreadWorker(_Worker):
+
+    def _create_queue(self):
+        return _CancellableQueue(QUEUE_SIZE)
+
+    def _create_process(self, args):
+        return _Thread(target=_parse_file_in_thread, args=args)
+
+    def terminate(self):
+        self._queue.cancel()
+
+
+class _Thread(threading.Thread):
+    # Reported like the exit code of a worker process that died
+    exitcode = None
+
+
+class _Cancelled(BaseException):
+    pass
+
+
+class _CancellableQueue(Queue):
+
+    def __init__(self, maxsize):
+        Queue.__init__(self, maxsize)
+        self._cancelled = threading.Event()
+
+    def put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                return Queue.put(self, item, timeout=0.1)
+            except Full:
+                pass
+        raise _Cancelled()
+
+    def cancel(self):
+        self._cancelled.set()
+
+
+def _parse_file_in_thread(*args):
+    try:
+        _parse_file(*args)
+    except _Cancelled:
+        pass
+
+
+def _parse_file(xml_file, parser_class, include_keywords, keyword_filter, use_mmap,
+                unique_columns, epoch_timestamps, batch_size, be_verbose, collect_metrics, queue):
+    metrics = Metrics(collect_metrics)
+    recorder = RowRecorder(unique_columns, batch_size, queue)
+    parser = parser_class(include_keywords, recorder, sys.stdout if be_verbose else None,
+                          use_mmap, metrics, epoch_timestamps, keyword_filter)
+    try:
+        parser.xml_to_db(xml_file)
+        recorder.flush()
+    except data_error() as error:
+        queue.put(('error', error))
+    except Exception:
+        queue.put(('failed', traceback.format_exc()))
+    else:
+        queue.put(('done', metrics.summary()))
+
+
+# Stands in for DatabaseWriter in worker processes. Ids of suites, tests,
+# keywords and test runs are handed out as placeholders that the writer
+# replaces with the real ids.
+class RowRecorder(object):
+
+    def __init__(self, unique_columns, batch_size, queue):
+        self._unique_columns = unique_columns
+        self._batch_size = batch_size
+        self._queue = queue
+        self._operations = []
+        self._size = 0
+        self._refs = {}
+        self._last_ref = 0
+
+    def insert_or_fetch_id(self, table_name, values):
+        key = (table_name,) + tuple(values[column] for column in self._unique_columns[table_name])
+        cacheable = None not in key
+        if cacheable and key in self._refs:
+            return self._refs[key], False
+        self._last_ref += 1
+        ref = self._last_ref
+        if cacheable:
+            self._refs[key] = ref
+        self._record(('insert_or_fetch_id', table_name, tuple(values.keys()),
+                      tuple(values.values()), ref))
+        return ref, True
+
+    def insert_or_ignore(self, table_name, criteria):
+        self._record_rows(table_name, tuple(criteria.keys()), [tuple(criteria.values())])
+
+    def insert_many_or_ignore(self, table_name, column_names, values):
+        if values:
+            self._record_rows(table_name, tuple(column_names), values)
+
+    def update(self, table_name, row_id, values):
+        self._record(('update', table_name, row_id, values))
+
+    def fail_test_statuses(self, test_run_id, suite_ids):
+        self._record(('fail_test_statuses', test_run_id, list(suite_ids)))
+
+    def fail_suite_statuses(self, test_run_id, suite_ids):
+        self._record(('fail_suite_statuses', test_run_id, list(suite_ids)))
+
+    def _record_rows(self, table_name, column_names, rows):
+        previous = self._operations[-1] if self._operations else None
+        if previous and previous[0] == 'insert_many_or_ignore' \
+                and previous[1] == table_name and previous[2] == column_names:
+            previous[3].extend(rows)
+            self._grow(len(rows))
+        else:
+            self._record(('insert_many_or_ignore', table_name, column_names, list(rows)), len(rows))
+
+    def _record(self, operation, size=1):
+        self._operations.append(operation)
+        self._grow(size)
+
+    def _grow(self, size):
+        self._size += size
+        if self._size >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._operations:
+            self._queue.put(('batch', self._operations))
+            self._operations = []
+            self._size = 0
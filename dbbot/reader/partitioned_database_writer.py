@@ -0,0 +1,195 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import os
+import re
+import time
+
+from dbbot import Logger
+from dbbot.partitions import partition_key, partition_path
+
+from .database_writer import DatabaseWriter
+
+
+TAIL_BLOCK_SIZE = 64 * 1024
+MAX_TAIL_SIZE = 16 * 1024 * 1024
+HEAD_SIZE = 4096
+
+_STARTTIME = re.compile(r'starttime="(\d{8} [^"]*)"')
+_GENERATED = re.compile(r'<robot [^>]*generated="(\d{8} [^"]*)"')
+
+class PartitionError(Exception):
+    pass
+
+
+# Writes each test run into the partition of the period it started in, see
+# dbbot.partitions. Parsers insert the test run before any of its other rows,
+# so the partition is chosen then and the rest of the calls go to it. Calls
+# preparing and finishing the import go to every partition opened, including
+# the ones opened later.
+class PartitionedDatabaseWriter(object):
+
+    def __init__(self, db_file_path, partition_by, verbose_stream, id_cache_size, batch_size,
+                 metrics, epoch_timestamps=False, compress_threshold=None):
+        self._verbose = Logger('Partition', verbose_stream)
+        self._verbose_stream = verbose_stream
+        self._db_file_path = db_file_path
+        self._partition_by = partition_by
+        self._writer_args = (id_cache_size, batch_size, metrics, epoch_timestamps,
+                             compress_threshold)
+        self._epoch_timestamps = epoch_timestamps
+        self._compress_threshold = compress_threshold
+        self._partitions = {}
+        self._current = None
+        self._preparations = []
+        with _closing(DatabaseWriter('', None)) as template:
+            self._unique_columns = template.unique_columns
+
+    @property
+    def unique_columns(self):
+        return dict(self._unique_columns)
+
+    @property
+    def epoch_timestamps(self):
+        return self._epoch_timestamps
+
+    @property
+    def interns_strings(self):
+        return True
+
+    def insert_or_fetch_id(self, table_name, values):
+        if table_name == 'test_runs':
+            self._select(values['source_file'])
+        return self._current.insert_or_fetch_id(table_name, values)
+
+    def _select(self, xml_file):
+        key = partition_key(_test_run_start(xml_file), self._partition_by)
+        if key not in self._partitions:
+            self._partitions[key] = self._open(partition_path(self._db_file_path, key))
+        self._current = self._partitions[key]
+
+    def _open(self, path):
+        self._verbose('- Opening partition %s' % path)
+        partition = DatabaseWriter(path, self._verbose_stream, *self._writer_args)
+        if partition.epoch_timestamps != self._epoch_timestamps:
+            partition.close()
+            raise PartitionError('partition "%s" stores %s timestamps, use the same '
+                                 '--epoch-timestamps setting as when it was created' % (
+                                 path, 'epoch' if partition.epoch_timestamps else 'DATETIME'))
+        if self._compress_threshold is not None and not partition.interns_strings:
+            partition.close()
+            raise PartitionError('partition "%s" was created by an older version without '
+                                 'a strings table, --compress-threshold cannot be used with it' % path)
+        for name, args in self._preparations:
+            getattr(partition, name)(*args)
+        return partition
+
+    def __getattr__(self, name):
+        if self._current is None:
+            raise AttributeError(name)
+        return getattr(self._current, name)
+
+    def configure_for_bulk_load(self):
+        self._prepare('configure_for_bulk_load')
+
+    def drop_indexes(self):
+        self._prepare('drop_indexes')
+
+    def preload_ids(self, *args):
+        self._prepare('preload_ids', *args)
+
+    def _prepare(self, name, *args):
+        self._preparations.append((name, args))
+        self._for_each(name, *args)
+
+    def create_indexes(self):
+        self._finish('create_indexes', 'drop_indexes')
+
+    def restore_configuration(self):
+        self._finish('restore_configuration', 'configure_for_bulk_load')
+
+    def _finish(self, name, preparation_name):
+        self._preparations = [preparation for preparation in self._preparations
+                              if preparation[0] != preparation_name]
+        self._for_each(name)
+
+    def analyze(self):
+        self._for_each('analyze')
+
+    def commit(self):
+        self._for_each('commit')
+
+    def rollback(self):
+        self._for_each('rollback')
+
+    def close(self):
+        self._for_each('close')
+        self._partitions.clear()
+        self._current = None
+
+    def _for_each(self, name, *args):
+        for key in sorted(self._partitions):
+            getattr(self._partitions[key], name)(*args)
+
+
+class _closing(object):
+
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        return self._db
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        self._db.close()
+
+
+# The status of the root suite is the last one before the statistics at the
+# end of output.xml, so it is searched for from the end. Outputs without it,
+# e.g. invalid ones, fall back to the generation time of the output and then
+# to the current time, so that they are rejected by the parser as usual.
+# The part read is doubled each round until MAX_TAIL_SIZE.
+def _test_run_start(xml_file):
+    try:
+        with open(xml_file, 'rb') as source:
+            return _root_suite_start(source) or _generated(source) or _now()
+    except EnvironmentError:
+        return _now()
+
+
+def _root_suite_start(source):
+    source.seek(0, os.SEEK_END)
+    position = source.tell()
+    tail = ''
+    while position > 0 and len(tail) < MAX_TAIL_SIZE:
+        size = min(max(TAIL_BLOCK_SIZE, len(tail)), position)
+        position -= size
+        source.seek(position)
+        tail = source.read(size) + tail
+        statistics = tail.find('<statistics')
+        status = tail.rfind('<status ', 0, statistics)
+        if statistics != -1 and status != -1:
+            match = _STARTTIME.search(tail, status, tail.find('>', status))
+            return match.group(1) if match else None
+    return None
+
+
+def _generated(source):
+    source.seek(0)
+    match = _GENERATED.search(source.read(HEAD_SIZE))
+    return match.group(1) if match else None
+
+
+def _now():
+    return time.strftime('%Y%m%d %H:%M:%S')
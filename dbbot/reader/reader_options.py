@@ -12,12 +12,20 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 from optparse import OptionParser
-from os.path import exists
+from os.path import exists, isdir
+
+from dbbot.partitions import PERIODS
+
+from .database_writer import DEFAULT_BATCH_SIZE, DEFAULT_ID_CACHE_SIZE
+from .keyword_filter import MESSAGE_LEVELS
 
 
 DEFAULT_DB_NAME = 'robot_results.db'
+BULK_COMMIT_INTERVAL = 50
 
-class ReaderOptions(object):
+# The options of every tool reading or writing a DbBot database, e.g. the
+# failbot example
+class DatabaseOptions(object):
 
     def __init__(self):
         self._parser = OptionParser()
@@ -25,6 +33,51 @@ class ReaderOptions(object):
         self._options, self._files = self._get_validated_options()
 
     def _add_parser_options(self):
+        options = [
+            ('-v', '--verbose', {'action': 'store_true',
+                                 'default': False,
+                                 'dest': 'be_verbose',
+                                 'help': 'be verbose about the operation'}),
+
+            ('-b', '--database', {'dest': 'db_file_path',
+                                  'default': DEFAULT_DB_NAME,
+                                  'help': 'path to the SQLite database for test run results'}),
+
+            ('--partition-by', {'type': 'choice',
+                                'choices': sorted(PERIODS),
+                                'dest': 'partition_by',
+                                'metavar': 'PERIOD',
+                                'help': 'write each test run into a database of its own '
+                                        'day, month or year, e.g. robot_results-2014-01.db '
+                                        'with month'})
+        ]
+        for option in options:
+            self._parser.add_option(*option[:-1], **option[-1])
+
+    def _get_validated_options(self):
+        return self._parser.parse_args()
+
+    def _exit_with_help(self):
+        self._parser.print_help()
+        exit(1)
+
+    @property
+    def db_file_path(self):
+        return self._options.db_file_path
+
+    @property
+    def be_verbose(self):
+        return self._options.be_verbose
+
+    @property
+    def partition_by(self):
+        return self._options.partition_by
+
+
+class ReaderOptions(DatabaseOptions):
+
+    def _add_parser_options(self):
+        super(ReaderOptions, self)._add_parser_options()
         options = [
             ('-d', '--dry-run', {'action': 'store_true',
                                  'default': False,
@@ -36,21 +89,160 @@ class ReaderOptions(object):
                                        'dest': 'include_keywords',
                                        'help': 'parse also suites\' and tests\' keywords'}),
 
-            ('-v', '--verbose', {'action': 'store_true',
+            ('--max-keyword-depth', {'type': 'int',
+                                     'dest': 'max_keyword_depth',
+                                     'metavar': 'N',
+                                     'help': 'skip keywords nested deeper than N levels, '
+                                             'suites\' and tests\' own keywords being on level 1'}),
+
+            ('--failed-keywords-only', {'action': 'store_true',
+                                        'default': False,
+                                        'dest': 'failed_keywords_only',
+                                        'help': 'parse only failed keywords, i.e. the keywords '
+                                                'on the path to a failure'}),
+
+            ('--message-level', {'type': 'choice',
+                                 'choices': sorted(MESSAGE_LEVELS),
+                                 'dest': 'message_level',
+                                 'metavar': 'LEVEL',
+                                 'help': 'skip keyword messages below LEVEL, e.g. INFO skips '
+                                         'TRACE and DEBUG messages'}),
+
+            ('--max-messages-per-test', {'type': 'int',
+                                         'dest': 'max_messages_per_test',
+                                         'metavar': 'COUNT',
+                                         'help': 'parse at most COUNT keyword messages per test, '
+                                                 'and per suite for suite setups and teardowns'}),
+
+            ('-s', '--streaming', {'action': 'store_true',
+                                   'default': False,
+                                   'dest': 'streaming',
+                                   'help': 'parse output.xml incrementally instead of '
+                                           'loading the whole result model into memory'}),
+
+            ('--id-cache-size', {'type': 'int',
+                                 'default': DEFAULT_ID_CACHE_SIZE,
+                                 'dest': 'id_cache_size',
+                                 'metavar': 'SIZE',
+                                 'help': 'number of suite, test and keyword ids to keep in '
+                                         'memory, 0 disables the cache (default: %default)'}),
+
+            ('--preload-ids', {'action': 'store_true',
+                               'default': False,
+                               'dest': 'preload_ids',
+                               'help': 'fill the id cache from the database before parsing'}),
+
+            ('--batch-size', {'type': 'int',
+                              'default': DEFAULT_BATCH_SIZE,
+                              'dest': 'batch_size',
+                              'metavar': 'ROWS',
+                              'help': 'number of status, tag, message and argument rows '
+                                      'written with a single statement (default: %default)'}),
+
+            ('--incremental', {'action': 'store_true',
+                               'default': False,
+                               'dest': 'incremental',
+                               'help': 'skip files that have already been imported, go on '
+                                       'after files that fail and print a summary'}),
+
+            ('--bulk', {'action': 'store_true',
+                        'default': False,
+                        'dest': 'bulk',
+                        'help': 'trade durability for speed when filling a new database: '
+                                'relax SQLite settings, defer the indexes and commit '
+                                'every %d files' % BULK_COMMIT_INTERVAL}),
+
+            ('--commit-interval', {'type': 'int',
+                                   'dest': 'commit_interval',
+                                   'metavar': 'FILES',
+                                   'help': 'commit after every FILES files (default: 1, '
+                                           'or %d with --bulk)' % BULK_COMMIT_INTERVAL}),
+
+            ('--defer-indexes', {'action': 'store_true',
                                  'default': False,
-                                 'dest': 'be_verbose',
-                                 'help': 'be verbose about the operation'}),
+                                 'dest': 'defer_indexes',
+                                 'help': 'drop the secondary indexes during the import and '
+                                         'create them again at the end'}),
 
-            ('-b', '--database', {'dest': 'db_file_path',
-                                  'default': DEFAULT_DB_NAME,
-                                  'help': 'path to the SQLite database for test run results'})
+            ('--epoch-timestamps', {'action': 'store_true',
+                                    'default': False,
+                                    'dest': 'epoch_timestamps',
+                                    'help': 'store timestamps of a new database as integer '
+                                            'milliseconds since the epoch instead of '
+                                            'DATETIME strings'}),
+
+            ('--compress-threshold', {'type': 'int',
+                                      'dest': 'compress_threshold',
+                                      'metavar': 'N',
+                                      'help': 'store message and argument texts of at least '
+                                              'N bytes compressed with zlib'}),
+
+            ('--mmap', {'action': 'store_true',
+                        'default': False,
+                        'dest': 'use_mmap',
+                        'help': 'read output.xml through a memory map'}),
+
+            ('-j', '--jobs', {'type': 'int',
+                              'default': 1,
+                              'dest': 'jobs',
+                              'metavar': 'N',
+                              'help': 'parse up to N files at a time in separate processes '
+                                      '(default: %default)'}),
+
+            ('--pipelined', {'action': 'store_true',
+                             'default': False,
+                             'dest': 'pipelined',
+                             'help': 'parse in a background thread while the results '
+                                     'parsed so far are written into the database'}),
+
+            ('--watch', {'dest': 'watch_dir',
+                         'metavar': 'DIR',
+                         'help': 'keep running and import output files as they appear '
+                                 'in DIR, moving them into DIR/done or DIR/failed'}),
+
+            ('--poll-interval', {'type': 'float',
+                                 'default': 1.0,
+                                 'dest': 'poll_interval',
+                                 'metavar': 'SECONDS',
+                                 'help': 'how often --watch looks for new files '
+                                         '(default: %default)'}),
+
+            ('--status-file', {'dest': 'status_file',
+                               'metavar': 'FILE',
+                               'help': 'write the throughput and lag of --watch as JSON '
+                                       'into FILE after every poll'}),
+
+            ('--exit-when-idle', {'action': 'store_true',
+                                  'default': False,
+                                  'dest': 'exit_when_idle',
+                                  'help': 'stop --watch once there are no files left '
+                                          'to import'}),
+
+            ('--metrics', {'dest': 'metrics_file',
+                           'metavar': 'FILE',
+                           'help': 'write timings and counters of the import as JSON '
+                                   'into FILE, - for standard output'}),
+
+            ('--profile', {'dest': 'profile_file',
+                           'metavar': 'FILE',
+                           'help': 'profile the import with cProfile and write the '
+                                   'statistics into FILE'})
         ]
         for option in options:
-            self._parser.add_option(option[0], option[1], **option[2])
+            self._parser.add_option(*option[:-1], **option[-1])
 
     def _get_validated_options(self):
-        options, files = self._parser.parse_args()
-        self._check_files(files)
+        options, files = super(ReaderOptions, self)._get_validated_options()
+        if options.watch_dir:
+            self._check_watch_dir(options.watch_dir, files)
+        else:
+            self._check_files(files)
+        self._check_jobs(options.jobs, options.pipelined)
+        self._check_commit_interval(options.commit_interval)
+        self._check_compress_threshold(options.compress_threshold)
+        self._check_keyword_filter(options)
+        self._check_watch(options)
+        self._check_partition_by(options)
         return options, files
 
     def _check_files(self, files):
@@ -60,17 +252,53 @@ class ReaderOptions(object):
             if not exists(file_path):
                 self._parser.error('file "%s" does not exist' % file_path)
 
-    def _exit_with_help(self):
-        self._parser.print_help()
-        exit(1)
+    def _check_watch_dir(self, watch_dir, files):
+        if files:
+            self._parser.error('input files cannot be given with --watch')
+        if not isdir(watch_dir):
+            self._parser.error('directory "%s" does not exist' % watch_dir)
 
-    @property
-    def db_file_path(self):
-        return self._options.db_file_path
+    def _check_jobs(self, jobs, pipelined):
+        if jobs < 1:
+            self._parser.error('number of jobs must be at least 1')
+        if jobs > 1 and pipelined:
+            self._parser.error('--pipelined cannot be used with --jobs')
 
-    @property
-    def be_verbose(self):
-        return self._options.be_verbose
+    def _check_commit_interval(self, commit_interval):
+        if commit_interval is not None and commit_interval < 1:
+            self._parser.error('commit interval must be at least 1')
+
+    def _check_compress_threshold(self, compress_threshold):
+        if compress_threshold is not None and compress_threshold < 0:
+            self._parser.error('compress threshold cannot be negative')
+
+    def _check_keyword_filter(self, options):
+        if options.max_keyword_depth is not None and options.max_keyword_depth < 1:
+            self._parser.error('max keyword depth must be at least 1')
+        if options.max_messages_per_test is not None and options.max_messages_per_test < 0:
+            self._parser.error('max messages per test cannot be negative')
+        filtered = (options.max_keyword_depth is not None or options.failed_keywords_only
+                    or options.message_level or options.max_messages_per_test is not None)
+        if filtered and not options.include_keywords:
+            self._parser.error('keyword filtering options require --also-keywords')
+
+    # A watching import commits each file on its own, so the options that
+    # trade durability for speed until the end of the import do not apply
+    def _check_watch(self, options):
+        if options.poll_interval <= 0:
+            self._parser.error('poll interval must be positive')
+        watch_options = options.status_file or options.exit_when_idle
+        if watch_options and not options.watch_dir:
+            self._parser.error('--status-file and --exit-when-idle require --watch')
+        if options.watch_dir and (options.bulk or options.defer_indexes or options.incremental):
+            self._parser.error('--watch cannot be used with --bulk, --defer-indexes '
+                               'or --incremental')
+
+    # Files already imported into any partition cannot be skipped without
+    # opening every partition
+    def _check_partition_by(self, options):
+        if options.partition_by and options.incremental:
+            self._parser.error('--partition-by cannot be used with --incremental')
 
     @property
     def file_paths(self):
@@ -83,3 +311,97 @@ class ReaderOptions(object):
     @property
     def include_keywords(self):
         return self._options.include_keywords
+
+    @property
+    def max_keyword_depth(self):
+        return self._options.max_keyword_depth
+
+    @property
+    def failed_keywords_only(self):
+        return self._options.failed_keywords_only
+
+    @property
+    def message_level(self):
+        return self._options.message_level
+
+    @property
+    def max_messages_per_test(self):
+        return self._options.max_messages_per_test
+
+    @property
+    def streaming(self):
+        return self._options.streaming
+
+    @property
+    def id_cache_size(self):
+        return self._options.id_cache_size
+
+    @property
+    def preload_ids(self):
+        return self._options.preload_ids
+
+    @property
+    def batch_size(self):
+        return self._options.batch_size
+
+    @property
+    def jobs(self):
+        return self._options.jobs
+
+    @property
+    def pipelined(self):
+        return self._options.pipelined
+
+    @property
+    def epoch_timestamps(self):
+        return self._options.epoch_timestamps
+
+    @property
+    def compress_threshold(self):
+        return self._options.compress_threshold
+
+    @property
+    def use_mmap(self):
+        return self._options.use_mmap
+
+    @property
+    def incremental(self):
+        return self._options.incremental
+
+    @property
+    def bulk(self):
+        return self._options.bulk
+
+    @property
+    def commit_interval(self):
+        if self._options.commit_interval:
+            return self._options.commit_interval
+        return BULK_COMMIT_INTERVAL if self.bulk else 1
+
+    @property
+    def watch_dir(self):
+        return self._options.watch_dir
+
+    @property
+    def poll_interval(self):
+        return self._options.poll_interval
+
+    @property
+    def status_file(self):
+        return self._options.status_file
+
+    @property
+    def exit_when_idle(self):
+        return self._options.exit_when_idle
+
+    @property
+    def metrics_file(self):
+        return self._options.metrics_file
+
+    @property
+    def profile_file(self):
+        return self._options.profile_file
+
+    @property
+    def defer_indexes(self):
+        return self._options.defer_indexes or self.bulk
@@ -0,0 +1,43 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Robot Framework takes a good part of a second to import, so it is imported
+# only once a file is parsed. These return the Robot Framework class or
+# function of their name, importing it when first called. The class in an
+# except clause is looked up only when an exception is raised, by which time
+# the parsers have imported it.
+
+def data_error():
+    from robot.errors import DataError
+    return DataError
+
+
+def execution_result():
+    from robot.api import ExecutionResult
+    return ExecutionResult
+
+
+def tags():
+    from robot.model import Tags
+    return Tags
+
+
+def normalized_dict():
+    from robot.utils import NormalizedDict
+    return NormalizedDict
+
+
+def get_elapsed_time():
+    from robot.utils import get_elapsed_time
+    return get_elapsed_time
@@ -12,53 +12,75 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 from __future__ import with_statement
-from datetime import datetime
-from hashlib import sha1
-from robot.api import ExecutionResult
-from sqlite3 import IntegrityError
+from itertools import chain
 
+from dbbot import Logger, Metrics
 
-from dbbot import Logger
+from .hashing_reader import HashingReader
+from .keyword_filter import KeywordFilter
+from .robot_imports import data_error, execution_result
+from .timestamp_converter import TimestampConverter
+from .tree_walker import START, walk
 
 
 class RobotResultsParser(object):
 
-    def __init__(self, include_keywords, db, verbose_stream):
+    def __init__(self, include_keywords, db, verbose_stream, use_mmap=False, metrics=None,
+                 epoch_timestamps=False, keyword_filter=None):
         self._verbose = Logger('Parser', verbose_stream)
         self._include_keywords = include_keywords
+        self._keyword_filter = keyword_filter or KeywordFilter()
         self._db = db
+        self._use_mmap = use_mmap
+        self._metrics = metrics or Metrics(enabled=False)
+        self._timestamps = TimestampConverter(epoch_timestamps)
 
+    # Robot Framework is imported only once a file is parsed, so that runs
+    # that parse nothing, e.g. incremental imports with nothing new, start fast
     def xml_to_db(self, xml_file):
         self._verbose('- Parsing %s' % xml_file)
-        test_run = ExecutionResult(xml_file, include_keywords=self._include_keywords)
-        hash = self._hash(xml_file)
+        with self._open(xml_file) as source:
+            with self._metrics.timer('load_xml'):
+                test_run = execution_result()(source, include_keywords=self._include_keywords)
+            with self._metrics.timer('hash'):
+                hash = source.hexdigest()
+        test_run_id, inserted = self._db.insert_or_fetch_id('test_runs', dict({
+            'hash': hash,
+            'imported_at': self._timestamps.now(),
+            'source_file': xml_file
+        }, **self._test_run_times(test_run.suite)))
+        if not inserted:
+            self._verbose('- Skipping %s, test run has already been imported' % xml_file)
+            self._metrics.count('test_runs_skipped')
+            return
+        with self._metrics.timer('parse_errors'):
+            self._parse_errors(test_run.errors.messages, test_run_id)
+        with self._metrics.timer('parse_statistics'):
+            self._parse_statistics(test_run.statistics, test_run_id)
+        with self._metrics.timer('parse_suites'):
+            self._parse_suite(test_run.suite, test_run_id)
+
+    def _test_run_times(self, root_suite):
+        return {
+            'started_at': self._test_run_time(root_suite.starttime),
+            'finished_at': self._test_run_time(root_suite.endtime)
+        }
+
+    def _test_run_time(self, timestamp):
+        if not timestamp:
+            return self._timestamps.missing
+        return self._format_robot_timestamp(timestamp)
+
+    def _open(self, xml_file):
         try:
-            test_run_id = self._db.insert('test_runs', {
-                'hash': hash,
-                'imported_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f'),
-                'source_file': test_run.source,
-                'started_at': self._format_robot_timestamp(test_run.suite.starttime) if test_run.suite.starttime else 'NULL',
-                'finished_at': self._format_robot_timestamp(test_run.suite.endtime) if test_run.suite.starttime else 'NULL'
-            })
-        except IntegrityError:
-            test_run_id = self._db.fetch_id('test_runs', {
-                'source_file': test_run.source,
-                'started_at': self._format_robot_timestamp(test_run.suite.starttime),
-                'finished_at': self._format_robot_timestamp(test_run.suite.endtime)
-            })
-        self._parse_errors(test_run.errors.messages, test_run_id)
-        self._parse_statistics(test_run.statistics, test_run_id)
-        self._parse_suite(test_run.suite, test_run_id)
+            return HashingReader(xml_file, self._use_mmap)
+        except EnvironmentError as error:
+            raise data_error()("Reading XML source '%s' failed: %s" % (xml_file, error.strerror))
 
     def _hash(self, xml_file):
-        block_size = 68157440
-        hasher = sha1()
-        with open(xml_file, 'rb') as f:
-            chunk = f.read(block_size)
-            while len(chunk) > 0:
-                hasher.update(chunk)
-                chunk = f.read(block_size)
-        return hasher.hexdigest()
+        with self._metrics.timer('hash'):
+            with self._open(xml_file) as source:
+                return source.hexdigest()
 
     def _parse_errors(self, errors, test_run_id):
         self._db.insert_many_or_ignore('test_run_errors',
@@ -73,11 +95,13 @@ class RobotResultsParser(object):
 
     def _parse_test_run_statistics(self, test_run_statistics, test_run_id):
         self._verbose('`--> Parsing test run statistics')
-        [self._parse_test_run_stats(stat, test_run_id) for stat in test_run_statistics]
+        for stat in test_run_statistics:
+            self._parse_test_run_stats(stat, test_run_id)
 
     def _parse_tag_statistics(self, tag_statistics, test_run_id):
         self._verbose('  `--> Parsing tag statistics')
-        [self._parse_tag_stats(stat, test_run_id) for stat in tag_statistics.tags.values()]
+        for stat in tag_statistics.tags.values():
+            self._parse_tag_stats(stat, test_run_id)
 
     def _parse_tag_stats(self, stat, test_run_id):
         self._db.insert_or_ignore('tag_status', {
@@ -98,25 +122,37 @@ class RobotResultsParser(object):
             'passed': stat.passed
         })
 
-    def _parse_suite(self, suite, test_run_id, parent_suite_id=None):
-        self._verbose('`--> Parsing suite: %s' % suite.name)
-        try:
-            suite_id = self._db.insert('suites', {
-                'suite_id': parent_suite_id,
-                'xml_id': suite.id,
-                'name': suite.name,
-                'source': suite.source,
-                'doc': suite.doc
-            })
-        except IntegrityError:
-            suite_id = self._db.fetch_id('suites', {
-                'name': suite.name,
-                'source': suite.source
-            })
+    # Suites, tests and keywords are walked with an explicit stack instead of
+    # recursion. The children of a node are pairs of a child and the method
+    # storing it, which returns the context of the child's own children.
+    def _parse_suite(self, suite, test_run_id):
+        contexts = [_Context(None, iter([(self._start_suite, suite)]), None, 0, None)]
+        while contexts:
+            for start, node in contexts[-1].children:
+                contexts.append(start(node, contexts[-1], test_run_id))
+                break
+            else:
+                contexts.pop()
+
+    def _start_suite(self, suite, parent, test_run_id):
+        self._verbose('`--> Parsing suite: %s', suite.name)
+        self._metrics.count('suites')
+        suite_id = self._store_suite(suite, parent.db_id)[0]
         self._parse_suite_status(test_run_id, suite_id, suite)
-        self._parse_suites(suite, test_run_id, suite_id)
-        self._parse_tests(suite.tests, test_run_id, suite_id)
-        self._parse_keywords(suite.keywords, test_run_id, suite_id, None)
+        return _Context(suite_id, chain(
+            ((self._start_suite, subsuite) for subsuite in suite.suites),
+            ((self._start_test, test) for test in suite.tests),
+            self._keywords(suite.keywords, 1)
+        ), (suite_id, None, None), 1, self._capped_messages(suite.keywords))
+
+    def _store_suite(self, suite, parent_suite_id):
+        return self._db.insert_or_fetch_id('suites', {
+            'suite_id': parent_suite_id,
+            'xml_id': suite.id,
+            'name': suite.name,
+            'source': suite.source,
+            'doc': suite.doc
+        })
 
     def _parse_suite_status(self, test_run_id, suite_id, suite):
         self._db.insert_or_ignore('suite_status', {
@@ -128,30 +164,23 @@ class RobotResultsParser(object):
             'status': suite.status
         })
 
-    def _parse_suites(self, suite, test_run_id, parent_suite_id):
-        [self._parse_suite(subsuite, test_run_id, parent_suite_id) for subsuite in suite.suites]
-
-    def _parse_tests(self, tests, test_run_id, suite_id):
-        [self._parse_test(test, test_run_id, suite_id) for test in tests]
-
-    def _parse_test(self, test, test_run_id, suite_id):
-        self._verbose('  `--> Parsing test: %s' % test.name)
-        try:
-            test_id = self._db.insert('tests', {
-                'suite_id': suite_id,
-                'xml_id': test.id,
-                'name': test.name,
-                'timeout': test.timeout,
-                'doc': test.doc
-            })
-        except IntegrityError:
-            test_id = self._db.fetch_id('tests', {
-                'suite_id': suite_id,
-                'name': test.name
-            })
+    def _start_test(self, test, parent, test_run_id):
+        self._verbose('  `--> Parsing test: %s', test.name)
+        self._metrics.count('tests')
+        test_id = self._store_test(test, parent.db_id)[0]
         self._parse_test_status(test_run_id, test_id, test)
         self._parse_tags(test.tags, test_id)
-        self._parse_keywords(test.keywords, test_run_id, None, test_id)
+        return _Context(test_id, self._keywords(test.keywords, 1), (None, test_id, None), 1,
+                        self._capped_messages(test.keywords))
+
+    def _store_test(self, test, suite_id):
+        return self._db.insert_or_fetch_id('tests', {
+            'suite_id': suite_id,
+            'xml_id': test.id,
+            'name': test.name,
+            'timeout': test.timeout,
+            'doc': test.doc
+        })
 
     def _parse_test_status(self, test_run_id, test_id, test):
         self._db.insert_or_ignore('test_status', {
@@ -166,31 +195,57 @@ class RobotResultsParser(object):
             [(test_id, tag) for tag in tags]
         )
 
-    def _parse_keywords(self, keywords, test_run_id, suite_id, test_id, keyword_id=None):
-        if self._include_keywords:
-            [self._parse_keyword(keyword, test_run_id, suite_id, test_id, keyword_id)
-            for keyword in keywords]
+    def _keywords(self, keywords, depth):
+        if not (self._include_keywords and keywords):
+            return ()
+        return ((self._start_keyword, keyword) for keyword in self._included(keywords, depth))
 
-    def _parse_keyword(self, keyword, test_run_id, suite_id, test_id, keyword_id):
-        try:
-            keyword_id = self._db.insert('keywords', {
-                'suite_id': suite_id,
-                'test_id': test_id,
-                'keyword_id': keyword_id,
-                'name': keyword.name,
-                'type': keyword.type,
-                'timeout': keyword.timeout,
-                'doc': keyword.doc
-            })
-        except IntegrityError:
-            keyword_id = self._db.fetch_id('keywords', {
-                'name': keyword.name,
-                'type': keyword.type
-            })
+    def _included(self, keywords, depth):
+        return (keyword for keyword in keywords
+                if self._keyword_filter.includes(keyword.status, depth))
+
+    def _start_keyword(self, keyword, parent, test_run_id):
+        self._metrics.count('keywords')
+        keyword_id = self._store_keyword(keyword, *parent.keyword_parent_ids)[0]
         self._parse_keyword_status(test_run_id, keyword_id, keyword)
-        self._parse_messages(keyword.messages, keyword_id)
+        if parent.capped_messages is None:
+            self._parse_messages(self._keyword_filter.messages(keyword.messages), keyword_id)
+        else:
+            self._parse_messages(parent.capped_messages[id(keyword)], keyword_id)
         self._parse_arguments(keyword.args, keyword_id)
-        self._parse_keywords(keyword.keywords, test_run_id, None, None, keyword_id)
+        depth = parent.keyword_depth + 1
+        return _Context(keyword_id, self._keywords(keyword.keywords, depth),
+                        (None, None, keyword_id), depth, parent.capped_messages)
+
+    # The streaming parser can only count messages as keywords end, so the
+    # messages under the cap are chosen in that order before storing any
+    def _capped_messages(self, keywords):
+        if not (self._include_keywords and self._keyword_filter.caps_messages):
+            return None
+        capped_messages = {}
+        cap = self._keyword_filter.message_cap()
+        path = []
+        for top_keyword in self._included(keywords, 1):
+            for event, keyword in walk(top_keyword, lambda keyword:
+                                       self._included(keyword.keywords, len(path) + 1)):
+                if event == START:
+                    path.append(keyword)
+                else:
+                    path.pop()
+                    capped_messages[id(keyword)] = cap.take(
+                        self._keyword_filter.messages(keyword.messages))
+        return capped_messages
+
+    def _store_keyword(self, keyword, suite_id, test_id, keyword_id):
+        return self._db.insert_or_fetch_id('keywords', {
+            'suite_id': suite_id,
+            'test_id': test_id,
+            'keyword_id': keyword_id,
+            'name': keyword.name,
+            'type': keyword.type,
+            'timeout': keyword.timeout,
+            'doc': keyword.doc
+        })
 
     def _parse_keyword_status(self, test_run_id, keyword_id, keyword):
         self._db.insert_or_ignore('keyword_status', {
@@ -212,4 +267,19 @@ class RobotResultsParser(object):
         )
 
     def _format_robot_timestamp(self, timestamp):
-        return datetime.strptime(timestamp, '%Y%m%d %H:%M:%S.%f')
+        return self._timestamps.convert(timestamp)
+
+
+# Where the children of a suite, test or keyword are stored. Keywords refer to
+# their parent with one of keyword_parent_ids, which are the suite_id, test_id
+# and keyword_id of a keyword row. keyword_depth is the depth of the child
+# keywords.
+class _Context(object):
+    __slots__ = ['db_id', 'children', 'keyword_parent_ids', 'keyword_depth', 'capped_messages']
+
+    def __init__(self, db_id, children, keyword_parent_ids, keyword_depth, capped_messages):
+        self.db_id = db_id
+        self.children = children
+        self.keyword_parent_ids = keyword_parent_ids
+        self.keyword_depth = keyword_depth
+        self.capped_messages = capped_messages
@@ -0,0 +1,96 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import os
+from collections import deque
+
+from dbbot import Logger, Metrics
+
+from .hashing_reader import HashingReader
+
+
+# Drops files that are already in the database. Size and modification time
+# are checked first so unchanged files are skipped without reading them.
+class SourceFileFilter(object):
+
+    def __init__(self, db, verbose_stream, use_mmap=False, metrics=None):
+        self._verbose = Logger('Filter', verbose_stream)
+        self._db = db
+        self._use_mmap = use_mmap
+        self._metrics = metrics or Metrics(enabled=False)
+        self._pending = deque()
+        self._fingerprints = []
+        self._hashes = set()
+        self.skipped = 0
+
+    def filter(self, xml_files):
+        for xml_file in xml_files:
+            if self._is_imported(xml_file):
+                self._verbose('- Skipping %s, test run has already been imported' % xml_file)
+                self.skipped += 1
+            else:
+                yield xml_file
+
+    def _is_imported(self, xml_file):
+        try:
+            stat = os.stat(xml_file)
+            if self._db.source_file_imported(xml_file, stat.st_size, stat.st_mtime):
+                return True
+            hash = self._hash(xml_file)
+        # Unreadable files are left for the parser to report
+        except EnvironmentError:
+            self._pending.append(None)
+            return False
+        fingerprint = {
+            'path': xml_file,
+            'size': stat.st_size,
+            'modified_at': stat.st_mtime,
+            'hash': hash
+        }
+        if hash in self._hashes or self._db.test_run_imported(hash):
+            self._fingerprints.append(fingerprint)
+            return True
+        self._pending.append(fingerprint)
+        return False
+
+    def _hash(self, xml_file):
+        with self._metrics.timer('hash'):
+            with HashingReader(xml_file, self._use_mmap) as source:
+                return source.hexdigest()
+
+    # The importers take files from filter ahead of writing them, so a copy of
+    # a file still being imported is let through. Its test run is then found
+    # in the database when it is written, unless the first one failed. Files
+    # are reported here in the order filter yielded them. Returns False for
+    # such a copy, which is counted as skipped.
+    def imported(self, xml_file):
+        fingerprint = self._pending.popleft()
+        if not fingerprint:
+            return True
+        self._fingerprints.append(fingerprint)
+        if fingerprint['hash'] in self._hashes:
+            self.skipped += 1
+            return False
+        self._hashes.add(fingerprint['hash'])
+        return True
+
+    def failed(self, xml_file):
+        self._pending.popleft()
+
+    # Fingerprints are kept until the next commit so that rolling back a
+    # failed file does not lose those of the files skipped meanwhile
+    def store_fingerprints(self):
+        for fingerprint in self._fingerprints:
+            self._db.insert_or_ignore('source_files', fingerprint)
+        self._fingerprints = []
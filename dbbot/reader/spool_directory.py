@@ -0,0 +1,151 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+import json
+import os
+import time
+from datetime import datetime
+
+from dbbot import Logger
+
+
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+
+# The directory watched with --watch. Files are polled for, since the
+# standard library has no portable way to be notified of new files. A file
+# is ready once its size and modification time are the same on two polls in
+# a row, so that files still being written are left alone.
+class SpoolDirectory(object):
+
+    def __init__(self, path, verbose_stream):
+        self._verbose = Logger('Spool', verbose_stream)
+        self._path = path
+        self._done_dir = self._create_dir(DONE_DIR)
+        self._failed_dir = self._create_dir(FAILED_DIR)
+        self._seen = {}
+
+    def _create_dir(self, name):
+        path = os.path.join(self._path, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    # Returns the ready files in the order they were modified and the number
+    # of files still being written
+    def poll(self):
+        seen = {}
+        for name in os.listdir(self._path):
+            path = os.path.join(self._path, name)
+            if name.endswith('.xml') and os.path.isfile(path):
+                try:
+                    stat = os.stat(path)
+                except EnvironmentError:
+                    continue
+                seen[path] = (stat.st_size, stat.st_mtime)
+        ready = sorted((path for path in seen if self._seen.get(path) == seen[path]),
+                       key=lambda path: (seen[path][1], path))
+        self._seen = seen
+        return ready, len(seen) - len(ready)
+
+    def modified_at(self, path):
+        return self._seen[path][1]
+
+    def done(self, path):
+        self._move(path, self._done_dir)
+
+    def failed(self, path):
+        self._move(path, self._failed_dir)
+
+    # An existing file of the same name is not overwritten, e.g. when CI
+    # reuses output names, but a number is added to the name instead. A file
+    # removed or renamed meanwhile is left as it is.
+    def _move(self, path, directory):
+        name = os.path.basename(path)
+        base, extension = os.path.splitext(name)
+        target = os.path.join(directory, name)
+        index = 0
+        while os.path.exists(target):
+            index += 1
+            target = os.path.join(directory, '%s-%d%s' % (base, index, extension))
+        self._verbose('- Moving %s to %s' % (path, target))
+        try:
+            os.rename(path, target)
+        except OSError as error:
+            self._verbose('- Cannot move %s: %s' % (path, error.strerror))
+        self._seen.pop(path, None)
+
+
+# Keeps the counters of a watching import and writes them into the status
+# file given with --status-file. Lag is the time from the last modification
+# of a file to the commit of its results.
+class ImportStatus(object):
+
+    def __init__(self, path):
+        self._path = path
+        self._started_at = time.time()
+        self.imported = 0
+        self.failed = 0
+        self._import_seconds = 0.0
+        self._last_file = None
+        self._last_import_seconds = None
+        self._last_lag_seconds = None
+        self._max_lag_seconds = None
+
+    def file_imported(self, path, import_seconds, lag_seconds):
+        self.imported += 1
+        self._import_seconds += import_seconds
+        self._last_file = path
+        self._last_import_seconds = import_seconds
+        self._last_lag_seconds = lag_seconds
+        self._max_lag_seconds = max(self._max_lag_seconds, lag_seconds)
+
+    def file_failed(self, path):
+        self.failed += 1
+        self._last_file = path
+
+    def write(self, waiting, state='watching'):
+        if not self._path:
+            return
+        now = time.time()
+        status = {
+            'pid': os.getpid(),
+            'state': state,
+            'started_at': _format_time(self._started_at),
+            'updated_at': _format_time(now),
+            'imported': self.imported,
+            'failed': self.failed,
+            'waiting': waiting,
+            'files_per_hour': round(self.imported * 3600 / max(now - self._started_at, 1), 1),
+            'mean_import_seconds': self._round(self._import_seconds / self.imported
+                                               if self.imported else None),
+            'last_file': self._last_file,
+            'last_import_seconds': self._round(self._last_import_seconds),
+            'last_lag_seconds': self._round(self._last_lag_seconds),
+            'max_lag_seconds': self._round(self._max_lag_seconds)
+        }
+        # Readers never see a partly written file
+        temporary = self._path + '.tmp'
+        with open(temporary, 'w') as output:
+            output.write(json.dumps(status, indent=2, sort_keys=True) + '\n')
+        if os.name == 'nt' and os.path.exists(self._path):
+            os.remove(self._path)
+        os.rename(temporary, self._path)
+
+    def _round(self, seconds):
+        return round(seconds, 3) if seconds is not None else None
+
+
+def _format_time(seconds):
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%SZ')
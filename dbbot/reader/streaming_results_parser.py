@@ -0,0 +1,484 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from __future__ import with_statement
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+from .robot_imports import data_error, get_elapsed_time, normalized_dict, tags
+from .robot_results_parser import RobotResultsParser
+from .tree_walker import walk
+
+
+class StreamingResultsParser(RobotResultsParser):
+
+    def __init__(self, include_keywords, db, verbose_stream, use_mmap=False, metrics=None,
+                 epoch_timestamps=False, keyword_filter=None):
+        super(StreamingResultsParser, self).__init__(include_keywords, db, verbose_stream, use_mmap,
+                                                     metrics, epoch_timestamps, keyword_filter)
+        self._start_handlers = {
+            'suite': self._start_suite,
+            'test': self._start_test,
+            'kw': self._start_keyword,
+            'errors': self._start_errors
+        }
+        self._end_handlers = {
+            'suite': self._end_suite,
+            'test': self._end_test,
+            'kw': self._end_keyword,
+            'doc': self._end_doc,
+            'status': self._end_status,
+            'tag': self._end_tag,
+            'arg': self._end_arg,
+            'msg': self._end_msg,
+            'errors': self._end_errors
+        }
+
+    def xml_to_db(self, xml_file):
+        self._verbose('- Parsing %s' % xml_file)
+        # Rows reference the test run before the end of the file is reached,
+        # so the hash is computed up front. This also lets an already
+        # imported file be skipped without parsing it.
+        self._test_run_id, inserted = self._db.insert_or_fetch_id('test_runs', {
+            'hash': self._hash(xml_file),
+            'imported_at': self._timestamps.now(),
+            'source_file': xml_file
+        })
+        if not inserted:
+            self._verbose('- Skipping %s, test run has already been imported' % xml_file)
+            self._metrics.count('test_runs_skipped')
+            return
+        self._nodes = []
+        self._elements = []
+        self._errors = []
+        self._held = 0
+        self._omitting = False
+        self._omitted_status = None
+        self._replaying = False
+        try:
+            with self._open(xml_file) as source:
+                # Parsing and storing are interleaved, so they are timed together
+                with self._metrics.timer('parse_xml'):
+                    self._walk(iterparse(source, events=('start', 'end')))
+        except (IOError, SyntaxError) as error:
+            raise data_error()("Reading XML source '%s' failed: %s" % (xml_file, error))
+
+    def _walk(self, events):
+        for event, elem in events:
+            if event == 'start':
+                self._start(elem)
+            else:
+                self._end(elem)
+
+    # With --failed-keywords-only the status, which follows the children of a
+    # keyword in output.xml, decides whether a keyword is stored. Keywords of
+    # tests are then held too, each until the next one starts, and filtered
+    # when replayed.
+    def _start(self, elem):
+        if elem.tag == 'kw' and not (self._held or self._replaying) \
+                and isinstance(self._nodes[-1], _TestNode) and self._nodes[-1].keywords:
+            self._replay_keywords(self._nodes[-1])
+        self._elements.append(elem)
+        if self._held:
+            self._held += 1
+        elif elem.tag == 'statistics':
+            self._hold(omit=True)
+        elif elem.tag == 'kw' and not self._include_keywords:
+            self._hold(omit=True)
+        elif elem.tag == 'kw' and not self._replaying and (
+                self._keyword_filter.failed_only or isinstance(self._nodes[-1], _SuiteNode)):
+            self._hold(omit=False)
+        elif elem.tag == 'kw' and not self._keyword_filter.includes(
+                self._replayed_status(elem), self._keyword_depth()):
+            self._skip_keyword(elem)
+        elif elem.tag in self._start_handlers:
+            self._start_handlers[elem.tag](elem)
+
+    # Only replayed keywords have been read to the end
+    def _replayed_status(self, elem):
+        if not self._replaying:
+            return None
+        status = elem.find('status')
+        return status.get('status', 'FAIL') if status is not None else 'FAIL'
+
+    def _keyword_depth(self):
+        parent = self._nodes[-1]
+        return parent.depth + 1 if isinstance(parent, _KeywordNode) else 1
+
+    # Keywords of suites are always replayed. Those left out still count
+    # towards the elapsed time and teardown status of the suite, like in the
+    # result model.
+    def _skip_keyword(self, elem):
+        if isinstance(self._nodes[-1], _SuiteNode):
+            keyword = _KeywordNode(elem, self._nodes[-1])
+            keyword.set_status(elem.find('status'))
+            self._nodes[-1].add_keyword(keyword)
+        self._hold(omit=True)
+
+    def _hold(self, omit):
+        self._held = 1
+        self._omitting = omit
+        self._omitted_status = None
+
+    def _end(self, elem):
+        retain = False
+        if self._held:
+            retain = self._end_held(elem)
+        elif elem.tag in self._end_handlers:
+            self._end_handlers[elem.tag](elem)
+        self._elements.pop()
+        if not retain:
+            self._discard(elem)
+
+    def _end_held(self, elem):
+        self._held -= 1
+        if not self._omitting:
+            if not self._held:
+                self._nodes[-1].keywords.append(elem)
+            return True
+        if self._held == 1 and elem.tag == 'status':
+            self._omitted_status = elem.get('status', 'FAIL')
+        if not self._held and elem.tag == 'kw' and elem.get('type') == 'teardown':
+            self._nodes[-1].add_teardown_status(self._omitted_status)
+        return False
+
+    def _discard(self, elem):
+        elem.clear()
+        if self._elements:
+            self._elements[-1].remove(elem)
+
+    def _start_suite(self, elem):
+        parent = self._nodes[-1] if self._nodes else None
+        if parent:
+            self._store_parent()
+        suite = _SuiteNode(elem, parent, self._keyword_filter.message_cap())
+        self._verbose('`--> Parsing suite: %s', suite.name)
+        self._metrics.count('suites')
+        self._nodes.append(suite)
+
+    def _start_test(self, elem):
+        self._store_parent()
+        test = _TestNode(elem, self._nodes[-1], self._keyword_filter.message_cap())
+        self._verbose('  `--> Parsing test: %s', test.name)
+        self._metrics.count('tests')
+        self._nodes.append(test)
+
+    def _start_keyword(self, elem):
+        self._store_parent()
+        self._nodes.append(_KeywordNode(elem, self._nodes[-1]))
+
+    def _start_errors(self, elem):
+        self._errors = []
+
+    def _store_parent(self):
+        parent = self._nodes[-1]
+        if parent.db_id is None:
+            self._store(parent)
+
+    def _store(self, node):
+        parent = node.parent
+        if isinstance(node, _SuiteNode):
+            node.db_id, node.inserted = self._store_suite(node, parent.db_id if parent else None)
+        elif isinstance(node, _TestNode):
+            node.db_id, node.inserted = self._store_test(node, parent.db_id)
+        else:
+            node.db_id, node.inserted = self._store_keyword(node,
+                parent.db_id if isinstance(parent, _SuiteNode) else None,
+                parent.db_id if isinstance(parent, _TestNode) else None,
+                parent.db_id if isinstance(parent, _KeywordNode) else None
+            )
+
+    # Suite and test documentation follows their children in output.xml, so
+    # a row stored early for its children's sake gets its doc afterwards.
+    def _store_with_doc(self, node, table_name):
+        if node.db_id is None:
+            self._store(node)
+        elif node.inserted and node.doc:
+            self._db.update(table_name, node.db_id, {'doc': node.doc})
+
+    # Suite setups precede subsuites and tests in output.xml but are stored
+    # after them by RobotResultsParser. Suite keywords are therefore held in
+    # the tree until their suite ends and replayed from there, which keeps the
+    # keyword ids and parent references identical to the non-streaming import.
+    # Children are copied to a list because they are removed as they end.
+    def _replay_keywords(self, node):
+        self._replaying = True
+        for keyword in node.keywords:
+            self._walk(walk(keyword, list))
+        self._replaying = False
+        node.keywords = []
+
+    def _end_suite(self, elem):
+        suite = self._nodes[-1]
+        self._store_with_doc(suite, 'suites')
+        self._replay_keywords(suite)
+        self._nodes.pop()
+        if suite.teardown_failed:
+            self._fail_suite(suite)
+        self._parse_suite_status(self._test_run_id, suite.db_id, suite)
+        if suite.parent:
+            suite.parent.add_suite(suite)
+        else:
+            self._end_root_suite(suite)
+
+    def _fail_suite(self, suite):
+        suite.statistics.fail_all()
+        self._db.fail_test_statuses(self._test_run_id, [suite.db_id] + suite.suite_ids)
+        self._db.fail_suite_statuses(self._test_run_id, suite.suite_ids)
+
+    def _end_root_suite(self, suite):
+        self._db.update('test_runs', self._test_run_id, self._test_run_times(suite))
+        self._parse_statistics(suite.statistics, self._test_run_id)
+
+    def _end_test(self, elem):
+        test = self._nodes[-1]
+        self._store_with_doc(test, 'tests')
+        self._replay_keywords(test)
+        self._nodes.pop()
+        self._parse_test_status(self._test_run_id, test.db_id, test)
+        self._parse_tags(test.tags, test.db_id)
+        test.parent.add_test(test)
+
+    def _end_keyword(self, elem):
+        self._metrics.count('keywords')
+        keyword = self._nodes.pop()
+        if keyword.db_id is None:
+            self._store(keyword)
+        self._parse_keyword_status(self._test_run_id, keyword.db_id, keyword)
+        self._parse_messages(keyword.owner.message_cap.take(keyword.messages), keyword.db_id)
+        self._parse_arguments(keyword.args, keyword.db_id)
+        keyword.parent.add_keyword(keyword)
+
+    def _end_doc(self, elem):
+        self._nodes[-1].doc = elem.text or ''
+
+    def _end_status(self, elem):
+        self._nodes[-1].set_status(elem)
+
+    def _end_tag(self, elem):
+        self._nodes[-1].tags.add(elem.text or '')
+
+    def _end_arg(self, elem):
+        self._nodes[-1].args += (elem.text or '',)
+
+    def _end_msg(self, elem):
+        if not self._nodes:
+            self._errors.append(_Message(elem))
+        elif self._keyword_filter.includes_message(elem.get('level')):
+            self._nodes[-1].messages.append(_Message(elem))
+
+    def _end_errors(self, elem):
+        self._parse_errors(self._errors, self._test_run_id)
+        self._errors = []
+
+
+def _timestamp(elem, name):
+    timestamp = elem.get(name)
+    return timestamp if timestamp != 'N/A' else None
+
+
+class _Message(object):
+    __slots__ = ['level', 'timestamp', 'message']
+
+    def __init__(self, elem):
+        self.level = elem.get('level')
+        self.timestamp = _timestamp(elem, 'timestamp')
+        self.message = elem.text or ''
+
+
+class _Node(object):
+
+    def __init__(self, elem, parent):
+        self.parent = parent
+        self.name = elem.get('name')
+        self.doc = ''
+        self.starttime = None
+        self.endtime = None
+        self.db_id = None
+        self.inserted = False
+
+    def set_status(self, elem):
+        self.status = elem.get('status', 'FAIL')
+        self.starttime = _timestamp(elem, 'starttime')
+        self.endtime = _timestamp(elem, 'endtime')
+
+    @property
+    def elapsedtime(self):
+        return get_elapsed_time()(self.starttime, self.endtime)
+
+    def add_keyword(self, keyword):
+        pass
+
+    def add_teardown_status(self, status):
+        pass
+
+
+class _SuiteNode(_Node):
+
+    def __init__(self, elem, parent, message_cap):
+        super(_SuiteNode, self).__init__(elem, parent)
+        self.id = parent.next_suite_id() if parent else 's1'
+        self.source = elem.get('source', '') if parent else elem.get('source')
+        self.message_cap = message_cap
+        self.keywords = []
+        self.suite_ids = []
+        self.statistics = _Statistics()
+        self.teardown_failed = False
+        self._suite_count = 0
+        self._test_count = 0
+        self._children_elapsed = 0
+
+    def next_suite_id(self):
+        self._suite_count += 1
+        return '%s-s%d' % (self.id, self._suite_count)
+
+    def next_test_id(self):
+        self._test_count += 1
+        return '%s-t%d' % (self.id, self._test_count)
+
+    def set_status(self, elem):
+        self.starttime = _timestamp(elem, 'starttime')
+        self.endtime = _timestamp(elem, 'endtime')
+
+    @property
+    def status(self):
+        return 'FAIL' if self.statistics.critical.failed else 'PASS'
+
+    @property
+    def elapsedtime(self):
+        if self.starttime and self.endtime:
+            return get_elapsed_time()(self.starttime, self.endtime)
+        return self._children_elapsed
+
+    def add_suite(self, suite):
+        self.statistics.add_statistics(suite.statistics)
+        self.suite_ids.append(suite.db_id)
+        self.suite_ids.extend(suite.suite_ids)
+        self._children_elapsed += suite.elapsedtime
+
+    def add_test(self, test):
+        self.statistics.add_test(test)
+        self._children_elapsed += test.elapsedtime
+
+    def add_keyword(self, keyword):
+        self._children_elapsed += keyword.elapsedtime
+        if keyword.type == 'teardown':
+            self.add_teardown_status(keyword.status)
+
+    def add_teardown_status(self, status):
+        self.teardown_failed = status == 'FAIL'
+
+
+class _TestNode(_Node):
+
+    def __init__(self, elem, parent, message_cap):
+        super(_TestNode, self).__init__(elem, parent)
+        self.id = parent.next_test_id()
+        self.timeout = elem.get('timeout')
+        self.message_cap = message_cap
+        self.keywords = []
+        self.tags = tags()()
+        self.status = 'FAIL'
+
+    @property
+    def passed(self):
+        return self.status == 'PASS'
+
+
+class _KeywordNode(_Node):
+
+    def __init__(self, elem, parent):
+        super(_KeywordNode, self).__init__(elem, parent)
+        nested = isinstance(parent, _KeywordNode)
+        self.depth = parent.depth + 1 if nested else 1
+        self.owner = parent.owner if nested else parent
+        self.type = elem.get('type')
+        self.timeout = elem.get('timeout')
+        self.status = 'FAIL'
+        self.args = ()
+        self.messages = []
+
+
+# Mirrors the shape of robot.model.Statistics used by _parse_statistics.
+# Without configured criticality every test is critical, as in the model.
+class _Statistics(object):
+
+    def __init__(self):
+        self.critical = _Stat('Critical Tests')
+        self.all = _Stat('All Tests')
+        self.tags = _TagStatistics()
+
+    @property
+    def total(self):
+        return [self.critical, self.all]
+
+    def add_test(self, test):
+        self.critical.add_test(test)
+        self.all.add_test(test)
+        self.tags.add_test(test)
+
+    def add_statistics(self, other):
+        self.critical.add_stat(other.critical)
+        self.all.add_stat(other.all)
+        self.tags.add_statistics(other.tags)
+
+    def fail_all(self):
+        for stat in self.total + self.tags.tags.values():
+            stat.fail_all()
+
+
+class _TagStatistics(object):
+
+    def __init__(self):
+        self.tags = normalized_dict()(ignore=['_'])
+
+    def add_test(self, test):
+        for tag in test.tags:
+            self._stat(tag).add_test(test)
+
+    def add_statistics(self, other):
+        for tag, stat in other.tags.items():
+            self._stat(tag).add_stat(stat)
+
+    def _stat(self, tag):
+        if tag not in self.tags:
+            self.tags[tag] = _Stat(tag)
+        return self.tags[tag]
+
+
+class _Stat(object):
+    critical = False
+
+    def __init__(self, name):
+        self.name = name
+        self.passed = 0
+        self.failed = 0
+        self.elapsed = 0
+
+    def add_test(self, test):
+        if test.passed:
+            self.passed += 1
+        else:
+            self.failed += 1
+        self.elapsed += test.elapsedtime
+
+    def add_stat(self, other):
+        self.passed += other.passed
+        self.failed += other.failed
+        self.elapsed += other.elapsed
+
+    def fail_all(self):
+        self.failed += self.passed
+        self.passed = 0
@@ -0,0 +1,69 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import re
+from calendar import timegm
+from datetime import datetime
+from time import time
+
+
+ROBOT_TIMESTAMP_FORMAT = '%Y%m%d %H:%M:%S.%f'
+ROBOT_TIMESTAMP = re.compile(r'(\d{8}) ([01]\d|2[0-3]):([0-5]\d):([0-5]\d)\.(\d{3})$')
+
+# Converts output.xml timestamps such as '20131204 13:45:12.345' into
+# DATETIME strings or, for databases created with --epoch-timestamps, into
+# milliseconds since the epoch. Timestamps have no time zone, so they are
+# taken as UTC. Only the date part is parsed with strptime, once per day;
+# the time is sliced from the matched string.
+class TimestampConverter(object):
+
+    def __init__(self, epoch=False):
+        self._epoch = epoch
+        self._dates = {}
+        self.missing = None if epoch else 'NULL'
+
+    def convert(self, timestamp):
+        match = ROBOT_TIMESTAMP.match(timestamp) if timestamp else None
+        if not match:
+            return self._convert_with_strptime(timestamp)
+        date, hours, minutes, seconds, milliseconds = match.groups()
+        if self._epoch:
+            return (self._date(date) + (int(hours) * 3600 + int(minutes) * 60 + int(seconds)) * 1000
+                    + int(milliseconds))
+        # Same strings as sqlite3 stores datetime objects as, which leaves
+        # out zero microseconds
+        if milliseconds == '000':
+            return '%s %s:%s:%s' % (self._date(date), hours, minutes, seconds)
+        return '%s %s:%s:%s.%s000' % (self._date(date), hours, minutes, seconds, milliseconds)
+
+    def _date(self, date):
+        if date not in self._dates:
+            parsed = datetime.strptime(date, '%Y%m%d')
+            if self._epoch:
+                self._dates[date] = timegm(parsed.timetuple()) * 1000
+            else:
+                self._dates[date] = '%s-%s-%s' % (date[:4], date[4:6], date[6:])
+        return self._dates[date]
+
+    # Timestamps of any other shape go through strptime, which also raises
+    # the errors for invalid ones
+    def _convert_with_strptime(self, timestamp):
+        parsed = datetime.strptime(timestamp, ROBOT_TIMESTAMP_FORMAT)
+        if self._epoch:
+            return timegm(parsed.timetuple()) * 1000 + parsed.microsecond // 1000
+        return parsed
+
+    def now(self):
+        if self._epoch:
+            return int(time() * 1000)
+        return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
@@ -0,0 +1,35 @@
+#  Copyright 2013-2014 Nokia Solutions and Networks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+START = 'start'
+END = 'end'
+
+# Walks a tree depth first with an explicit stack instead of recursion, so
+# the depth of the tree is not limited by the Python stack. Yields a START
+# event before and an END event after the children of each node. The
+# children of a node are asked for only after its START event has been
+# handled, which lets the handler decide what to walk into.
+def walk(root, children):
+    yield START, root
+    stack = [(root, iter(children(root)))]
+    while stack:
+        node, pending = stack[-1]
+        for child in pending:
+            yield START, child
+            stack.append((child, iter(children(child))))
+            break
+        else:
+            stack.pop()
+            yield END, node
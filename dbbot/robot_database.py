@@ -11,32 +11,348 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import os
 import sqlite3
+import zlib
+from hashlib import sha1
+from urllib import quote
 
 from .logger import Logger
+from .query_cache import CachedRow
 
 
+# Used by bulk loads: a 256 MB page cache (negative values are in KiB) and
+# up to 256 MB of the database file read through a memory map
+BULK_CACHE_SIZE = -256 * 1024
+BULK_MMAP_SIZE = 256 * 1024 * 1024
+
+# Secondary indexes for the common queries as (name, table, columns, WHERE).
+# Lookups by the first columns of UNIQUE constraints, e.g.
+# interned_messages.keyword_id or tests.suite_id, use the indexes of the
+# constraints instead.
+INDEXES = (
+    ('index_test_runs_started_at', 'test_runs', ('started_at',), None),
+    ('index_suite_status_failed', 'suite_status', ('suite_id',), "status='FAIL'"),
+    ('index_test_status_test_id', 'test_status', ('test_id',), None),
+    ('index_test_status_failed', 'test_status', ('test_id',), "status='FAIL'"),
+    ('index_keywords_suite_id', 'keywords', ('suite_id',), None),
+    ('index_keywords_test_id', 'keywords', ('test_id',), None),
+    ('index_keyword_status_keyword_id', 'keyword_status', ('keyword_id',), None),
+    ('index_keyword_status_test_run_id', 'keyword_status',
+     ('test_run_id', 'keyword_id', 'status'), None),
+    ('index_keyword_status_failed', 'keyword_status', ('keyword_id',), "status='FAIL'")
+)
+
+# Values of the strings.compressed column
+UNCOMPRESSED = 0
+ZLIB_COMPRESSED = 1
+
+# Ids of rows from the Nth attached partition are id * PARTITION_ID_FACTOR + N
+PARTITION_ID_FACTOR = 1000
+
+# Whether SQLite takes file: URIs, see RobotDatabase._read_only_uri()
+_URI_FILENAMES = []
+
 class RobotDatabase(object):
 
-    def __init__(self, db_file_path, verbose_stream):
+    def __init__(self, db_file_path, verbose_stream, query_cache=None, read_only=False):
         self._verbose = Logger('Database', verbose_stream)
+        self._db_file_path = db_file_path
+        self._verbose_stream = verbose_stream
+        self._query_cache = query_cache
+        self._read_only = read_only
+        self._partition_paths = []
+        self._schema_names = ['main']
+        self._data_versions = None
+        self._generation = None
         self._connection = self._connect(db_file_path)
         self._configure()
+        self._create_decompressing_views()
 
     def _connect(self, db_file_path):
         self._verbose('- Establishing database connection')
-        return sqlite3.connect(db_file_path)
+        connection = sqlite3.connect(self._read_only_uri(db_file_path) or db_file_path)
+        connection.create_function('dbbot_decompress', 2, self.decompress)
+        return connection
+
+    # SQLite opens read-only connections from file: URIs when it has been
+    # built with URI support, as e.g. the SQLite of Python 3 always is.
+    # Others would take the URI for a file name.
+    def _read_only_uri(self, db_file_path):
+        if not self._read_only or db_file_path in ('', ':memory:') or not _uri_filenames():
+            return None
+        path = os.path.abspath(db_file_path).replace(os.sep, '/')
+        return 'file:%s%s?mode=ro' % ('' if path.startswith('/') else '/', quote(path))
+
+    # Opens another connection to the same database and partitions, e.g. for
+    # another thread. It is read-only and shares the query cache.
+    def open_reader(self):
+        reader = type(self)(self._db_file_path, self._verbose_stream, self._query_cache,
+                            read_only=True)
+        if self._partition_paths:
+            reader.attach_partitions(self._partition_paths)
+        if not _uri_filenames():
+            reader._set_pragma('query_only', 'ON')
+        return reader
+
+    @staticmethod
+    def decompress(content, compressed):
+        if compressed == ZLIB_COMPRESSED:
+            return zlib.decompress(content).decode('utf-8')
+        return content
+
+    # The messages and arguments views return compressed texts as stored, so
+    # that the database stays readable without DbBot. Connections opened here
+    # get temporary views of the same names, which take precedence over the
+    # stored ones and decompress the texts.
+    def _create_decompressing_views(self):
+        for view_name in ('messages', 'arguments'):
+            if self._has_compressed_strings(view_name):
+                self._connection.execute('CREATE TEMP VIEW IF NOT EXISTS %s AS %s' % (
+                    view_name, self._decompressing_select(view_name)))
+
+    def _has_compressed_strings(self, view_name, schema_name='main'):
+        return (view_name in ('messages', 'arguments') and
+                'interned_' + view_name in self._names_in(schema_name) and
+                self._has_column('strings', 'compressed', schema_name))
+
+    # Reads the interned table behind a view like the view does, decompressing
+    # the texts the compressed column of the strings table marks
+    def _decompressing_select(self, view_name, schema_name='main'):
+        column_names = [row[1] for row in self._connection.execute(
+            'PRAGMA %s.table_info(%s)' % (schema_name, view_name))]
+        return ('SELECT %s FROM %s.interned_%s AS interned JOIN %s.strings AS strings '
+                'ON strings.id=interned.content_id' % (
+                    ', '.join('dbbot_decompress(strings.content, strings.compressed) AS content'
+                              if column_name == 'content'
+                              else 'interned.%s AS %s' % (column_name, column_name)
+                              for column_name in column_names),
+                    schema_name,
+                    view_name,
+                    schema_name
+                ))
+
+    # Databases created before the schema versions are at version 0, see
+    # dbbot.migrate
+    def schema_version(self):
+        try:
+            row = self._connection.execute('SELECT max(version) FROM schema_version').fetchone()
+        except sqlite3.OperationalError:
+            return 0
+        return row[0] or 0
+
+    def table_definition(self, table_name):
+        sql_statement = "SELECT sql FROM sqlite_master WHERE type='table' AND name=?"
+        row = self._connection.execute(sql_statement, [table_name]).fetchone()
+        return row[0] if row else None
+
+    def _has_column(self, table_name, column_name, schema_name='main'):
+        return any(row[1] == column_name for row in self._connection.execute(
+            'PRAGMA %s.table_info(%s)' % (schema_name, table_name)))
+
+    # Attaches partitioned databases, see dbbot.partitions, and replaces the
+    # tables and views of the connection with temporary views combining the
+    # rows of every partition, and of the main database if it has any. Ids
+    # are unique only within a partition, so the views renumber them along
+    # with the columns referencing them. SQLite attaches at most 10
+    # databases by default.
+    def attach_partitions(self, partition_paths):
+        self._verbose('- Attaching %d partitions' % len(partition_paths))
+        schemas = [('main', 0)] if 'test_runs' in self._names_in('main') else []
+        for number, path in enumerate(partition_paths, 1):
+            schema_name = 'partition_%d' % number
+            self._connection.execute('ATTACH DATABASE ? AS %s' % schema_name,
+                                     (self._read_only_uri(path) or path,))
+            schemas.append((schema_name, number))
+        self._partition_paths = list(partition_paths)
+        self._schema_names = [schema_name for schema_name, _ in schemas]
+        for view_name in self._names_in('temp'):
+            self._connection.execute('DROP VIEW temp.%s' % view_name)
+        names = []
+        for schema_name, _ in schemas:
+            names.extend(name for name in self._names_in(schema_name) if name not in names)
+        for name in names:
+            self._create_partitioned_view(name, schemas)
+
+    def _names_in(self, schema_name):
+        sql_statement = ("SELECT name FROM %s.sqlite_master WHERE type IN ('table', 'view') "
+                         "AND name NOT LIKE 'sqlite_%%' ORDER BY rowid" % schema_name)
+        return [row[0] for row in self._connection.execute(sql_statement)]
+
+    # The ids and the columns referencing them are the ones renumbered, not
+    # e.g. the TEXT column xml_id
+    def _create_partitioned_view(self, name, schemas):
+        columns = {}
+        column_names = []
+        id_columns = set(['id'])
+        for schema_name, _ in schemas:
+            columns[schema_name] = [row[1] for row in self._connection.execute(
+                'PRAGMA %s.table_info(%s)' % (schema_name, name))]
+            column_names.extend(column_name for column_name in columns[schema_name]
+                                if column_name not in column_names)
+            id_columns.update(row[3] for row in self._connection.execute(
+                'PRAGMA %s.foreign_key_list(%s)' % (schema_name, name)))
+        id_columns.update(self._referencing_view_columns(name, schemas))
+        selects = []
+        for schema_name, number in schemas:
+            if not columns[schema_name]:
+                continue
+            if self._has_compressed_strings(name, schema_name):
+                source = '(%s)' % self._decompressing_select(name, schema_name)
+            else:
+                source = '%s.%s' % (schema_name, name)
+            selects.append('SELECT %s FROM %s' % (
+                ', '.join(self._partitioned_column(column_name, columns[schema_name], number,
+                                                   column_name in id_columns)
+                          for column_name in column_names),
+                source
+            ))
+        sql_statement = ' UNION ALL '.join(selects)
+        # Every partition keeps its own rollup progress, see DatabaseWriter
+        if name == 'rollup_progress':
+            sql_statement = ('SELECT name, max(last_status_id) AS last_status_id FROM (%s) '
+                             'GROUP BY name' % sql_statement)
+        self._connection.execute('CREATE TEMP VIEW %s AS %s' % (name, sql_statement))
+
+    # The messages and arguments views have the foreign keys of the interned
+    # tables they read
+    def _referencing_view_columns(self, name, schemas):
+        interned_name = 'interned_' + name
+        column_names = set()
+        for schema_name, _ in schemas:
+            if interned_name in self._names_in(schema_name):
+                column_names.update(row[3] for row in self._connection.execute(
+                    'PRAGMA %s.foreign_key_list(%s)' % (schema_name, interned_name)))
+        return column_names
+
+    def _partitioned_column(self, column_name, column_names, partition_number, is_id):
+        if column_name not in column_names:
+            return 'NULL AS %s' % column_name
+        if is_id:
+            return '%s * %d + %d AS %s' % (column_name, PARTITION_ID_FACTOR, partition_number,
+                                           column_name)
+        return column_name
+
+    # Runs a read query, through the query cache if there is one. The rows
+    # are read as they are iterated, and cached once all have been read.
+    def query(self, sql_statement, parameters=()):
+        if not self._query_cache:
+            return self._connection.execute(sql_statement, parameters)
+        key = repr((self._database_files(), sql_statement, tuple(parameters)))
+        generation = self._current_generation()
+        cached = self._query_cache.get(key, generation)
+        if cached is None:
+            return self._query_and_cache(key, generation, sql_statement, parameters)
+        column_names, rows = cached
+        column_indexes = dict((name, index) for index, name in enumerate(column_names))
+        return (CachedRow(row, column_indexes) for row in rows)
+
+    def _query_and_cache(self, key, generation, sql_statement, parameters):
+        cursor = self._connection.execute(sql_statement, parameters)
+        collector = self._query_cache.collector()
+        if collector is None:
+            return cursor
+        collector.column_names = [description[0] for description in cursor.description]
+        return self._collect(cursor, collector, key, generation)
+
+    def _collect(self, cursor, collector, key, generation):
+        for row in cursor:
+            collector.add(row)
+            yield row
+        self._query_cache.set(key, generation, collector)
+
+    def _database_files(self):
+        return tuple((row[1], row[2]) for row in
+                     self._connection.execute('PRAGMA database_list') if row[1] != 'temp')
+
+    # Test runs are only added and removed as a whole, so the ids and hashes
+    # of the test runs tell whether the results of a query may have changed,
+    # also when the database file has been replaced by another one. They are
+    # read again only after another connection has changed a database.
+    def _current_generation(self):
+        data_versions = tuple(
+            self._connection.execute('PRAGMA %s.data_version' % schema_name).fetchone()[0]
+            for schema_name, _ in self._database_files())
+        if data_versions != self._data_versions:
+            try:
+                self._generation = self._test_runs_digest()
+            except sqlite3.OperationalError:
+                self._generation = None
+            self._data_versions = data_versions
+        return self._generation
+
+    def _test_runs_digest(self):
+        digest = sha1()
+        for test_run_id, test_run_hash in self._connection.execute(
+                'SELECT id, hash FROM test_runs ORDER BY id'):
+            digest.update('%s %s\n' % (test_run_id, test_run_hash))
+        return digest.hexdigest()
 
     def _configure(self):
         self._set_pragma('page_size', 4096)
         self._set_pragma('cache_size', 10000)
         self._set_pragma('synchronous', 'NORMAL')
-        self._set_pragma('journal_mode', 'WAL')
+        # Switching a database to WAL is a write
+        if not self._read_only:
+            self._set_pragma('journal_mode', 'WAL')
+
+    # Trades durability for speed. An interrupted bulk load may corrupt the
+    # database, so it is meant for filling new databases.
+    def configure_for_bulk_load(self):
+        self._verbose('- Configuring database for bulk load')
+        self._set_pragma('synchronous', 'OFF')
+        self._set_pragma('cache_size', BULK_CACHE_SIZE)
+        self._set_pragma('temp_store', 'MEMORY')
+        self._set_pragma('mmap_size', BULK_MMAP_SIZE)
+
+    def restore_configuration(self):
+        self._verbose('- Restoring database configuration')
+        self._set_pragma('temp_store', 'DEFAULT')
+        self._set_pragma('mmap_size', 0)
+        self._configure()
 
     def _set_pragma(self, name, value):
         sql_statement = 'PRAGMA %s=%s' % (name, value)
         self._connection.execute(sql_statement)
 
+    def create_indexes(self, table_names=None):
+        self._verbose('- Creating indexes')
+        for name, table_name, column_names, condition in self._supported_indexes():
+            if table_names is not None and table_name not in table_names:
+                continue
+            sql_statement = 'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                name,
+                table_name,
+                ', '.join(column_names)
+            )
+            if condition:
+                sql_statement += ' WHERE %s' % condition
+            self._connection.execute(sql_statement)
+
+    def drop_indexes(self):
+        self._verbose('- Dropping indexes')
+        for index in INDEXES:
+            self._connection.execute('DROP INDEX IF EXISTS %s' % index[0])
+
+    # Partial indexes need SQLite 3.8.0 or newer
+    def _supported_indexes(self):
+        if sqlite3.sqlite_version_info >= (3, 8, 0):
+            return INDEXES
+        return tuple(index for index in INDEXES if not index[3])
+
+    def commit(self):
+        self._connection.commit()
+
     def close(self):
         self._verbose('- Closing database connection')
         self._connection.close()
+
+
+def _uri_filenames():
+    if not _URI_FILENAMES:
+        connection = sqlite3.connect(':memory:')
+        options = [row[0] for row in connection.execute('PRAGMA compile_options')]
+        connection.close()
+        _URI_FILENAMES.append(any(option.startswith('USE_URI') and option != 'USE_URI=0'
+                                  for option in options))
+    return _URI_FILENAMES[0]
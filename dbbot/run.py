@@ -12,12 +12,21 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+from __future__ import with_statement
+import json
 import os
+import signal
 import sys
+import time
+from collections import deque
 
 sys.path.append(os.path.abspath(__file__ + '/../..'))
-from dbbot.reader import DatabaseWriter, ReaderOptions, RobotResultsParser
-from robot.errors import DataError
+from dbbot import Metrics
+from dbbot.reader import (DatabaseWriter, ImportStatus, KeywordFilter, ParallelImporter,
+                          PartitionedDatabaseWriter, PartitionError, ReaderOptions,
+                          RobotResultsParser, SourceFileFilter, SpoolDirectory,
+                          StreamingResultsParser)
+from dbbot.reader.robot_imports import data_error
 
 
 class DbBot(object):
@@ -25,27 +34,265 @@ class DbBot(object):
     def __init__(self):
         self._options = ReaderOptions()
         verbose_stream = sys.stdout if self._options.be_verbose else None
+        self._verbose_stream = verbose_stream
+        self._metrics = Metrics(enabled=self._options.metrics_file is not None)
         # '' for temporary database i.e. deleted after the connection is closed
         # see: http://www.sqlite.org/inmemorydb.html, section 'Temporary Databases'
         database_path = '' if self._options.dry_run else self._options.db_file_path
-        self._db = DatabaseWriter(database_path, verbose_stream)
-        self._parser = RobotResultsParser(
-            self._options.include_keywords,
+        if self._options.partition_by:
+            self._db = PartitionedDatabaseWriter(
+                database_path,
+                self._options.partition_by,
+                verbose_stream,
+                self._options.id_cache_size,
+                self._options.batch_size,
+                self._metrics,
+                self._options.epoch_timestamps,
+                self._options.compress_threshold
+            )
+        else:
+            self._db = DatabaseWriter(
+                database_path,
+                verbose_stream,
+                self._options.id_cache_size,
+                self._options.batch_size,
+                self._metrics,
+                self._options.epoch_timestamps,
+                self._options.compress_threshold
+            )
+        if self._options.epoch_timestamps and not self._db.epoch_timestamps:
+            sys.stderr.write('dbbot: error: --epoch-timestamps requires a new database, '
+                             '"%s" stores DATETIME strings\n\n' % database_path)
+            exit(1)
+        if self._options.compress_threshold is not None and not self._db.interns_strings:
+            sys.stderr.write('dbbot: error: --compress-threshold requires a database with a '
+                             'strings table, "%s" was created by an older version\n\n'
+                             % database_path)
+            exit(1)
+        if self._options.preload_ids:
+            self._db.preload_ids()
+        self._filter = SourceFileFilter(
             self._db,
-            verbose_stream
+            verbose_stream,
+            self._options.use_mmap,
+            self._metrics
+        ) if self._options.incremental else None
+        keyword_filter = KeywordFilter(
+            self._options.max_keyword_depth,
+            self._options.failed_keywords_only,
+            self._options.message_level,
+            self._options.max_messages_per_test
         )
+        parser_class = StreamingResultsParser if self._options.streaming else RobotResultsParser
+        if self._options.jobs > 1 or self._options.pipelined:
+            self._importer = ParallelImporter(
+                parser_class,
+                self._options.include_keywords,
+                self._db,
+                verbose_stream,
+                self._options.jobs,
+                self._options.batch_size,
+                self._options.use_mmap,
+                self._metrics,
+                keyword_filter,
+                self._options.pipelined
+            )
+        else:
+            self._importer = None
+            self._parser = parser_class(
+                self._options.include_keywords,
+                self._db,
+                verbose_stream,
+                self._options.use_mmap,
+                self._metrics,
+                self._db.epoch_timestamps,
+                keyword_filter
+            )
 
     def run(self):
+        profiler = None
+        if self._options.profile_file:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
         try:
-            for xml_file in self._options.file_paths:
-                self._parser.xml_to_db(xml_file)
-                self._db.commit()
-        except DataError, message:
-            sys.stderr.write('dbbot: error: Invalid XML: %s\n\n' % message)
+            with self._metrics.timer('total'):
+                self._run()
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(self._options.profile_file)
+            self._write_metrics()
+
+    def _run(self):
+        try:
+            if self._options.bulk:
+                self._db.configure_for_bulk_load()
+            if self._options.defer_indexes:
+                self._db.drop_indexes()
+            if self._options.watch_dir:
+                self._watch(self._options.watch_dir)
+            elif self._filter:
+                self._import_incrementally(self._options.file_paths)
+            else:
+                self._import(self._options.file_paths)
+        except PartitionError, error:
+            sys.stderr.write('dbbot: error: %s\n\n' % error)
             exit(1)
         finally:
+            if self._options.defer_indexes or self._options.bulk:
+                self._finish()
             self._db.close()
 
+    # Files imported before a failure are committed, see _import, so the
+    # indexes and settings are restored even then
+    def _finish(self):
+        self._db.rollback()
+        if self._options.defer_indexes:
+            self._db.create_indexes()
+        if self._options.bulk:
+            self._db.restore_configuration()
+            self._db.analyze()
+        self._db.commit()
+
+    # The import stops at the first file that fails. The files imported
+    # after the last commit are rolled back with it, so they are imported
+    # again and committed before exiting.
+    def _import(self, file_paths):
+        interval = self._options.commit_interval
+        uncommitted = []
+        imports = self._import_files(file_paths)
+        for xml_file, error in imports:
+            if error:
+                self._metrics.count('files_failed')
+                sys.stderr.write('dbbot: error: Invalid XML: %s\n\n' % error)
+                imports.close()
+                self._db.rollback()
+                self._import_again(uncommitted)
+                exit(1)
+            self._metrics.count('files_imported')
+            uncommitted.append(xml_file)
+            if len(uncommitted) == interval:
+                self._db.commit()
+                uncommitted = []
+        self._db.commit()
+
+    def _import_again(self, file_paths):
+        if not file_paths:
+            return
+        sys.stderr.write('dbbot: importing again %d files rolled back with the failed one\n'
+                         % len(file_paths))
+        for xml_file, error in self._import_files(file_paths):
+            if error:
+                self._db.rollback()
+                return
+        self._db.commit()
+
+    # A file that fails to import is rolled back and the import goes on with
+    # the next file. Each file is therefore committed on its own.
+    def _import_incrementally(self, file_paths):
+        imported = failed = 0
+        for xml_file, error in self._import_files(self._filter.filter(file_paths)):
+            if error:
+                self._db.rollback()
+                self._filter.failed(xml_file)
+                sys.stderr.write('dbbot: error: Invalid XML: %s\n\n' % error)
+                failed += 1
+            else:
+                if self._filter.imported(xml_file):
+                    imported += 1
+                self._filter.store_fingerprints()
+                self._db.commit()
+        self._filter.store_fingerprints()
+        self._db.commit()
+        sys.stdout.write('dbbot: %d imported, %d skipped, %d failed\n' % (
+            imported, self._filter.skipped, failed))
+        self._metrics.count('files_imported', imported)
+        self._metrics.count('files_skipped', self._filter.skipped)
+        self._metrics.count('files_failed', failed)
+        if failed:
+            exit(1)
+
+    # Imports the files appearing in the directory until terminated, or with
+    # --exit-when-idle until no files are left. The database connection, id
+    # cache and worker setup are kept between files. A file is moved only
+    # after its results have been committed, so a file imported again after
+    # a crash in between is skipped as already imported. A file failing
+    # otherwise than with invalid XML, e.g. when removed before it is parsed
+    # or when a worker dies, is moved aside as failed. The importer cannot go
+    # on after that, so the files after it are imported on the next poll.
+    def _watch(self, directory):
+        spool = SpoolDirectory(directory, self._verbose_stream)
+        status = ImportStatus(self._options.status_file)
+        stopping = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: stopping.append(signum))
+        while not stopping:
+            ready, waiting = spool.poll()
+            pending = deque(ready)
+            started_at = time.time()
+            try:
+                for xml_file, error in self._import_files(ready):
+                    if error:
+                        self._watched_file_failed(xml_file, 'Invalid XML: %s' % error,
+                                                  spool, status)
+                    else:
+                        self._db.commit()
+                        now = time.time()
+                        status.file_imported(xml_file, now - started_at,
+                                             now - spool.modified_at(xml_file))
+                        spool.done(xml_file)
+                    pending.popleft()
+                    started_at = time.time()
+                    if stopping:
+                        break
+            except Exception as error:
+                if not pending:
+                    raise
+                self._watched_file_failed(pending[0], 'Importing %s failed: %s'
+                                          % (pending[0], error), spool, status)
+            status.write(waiting)
+            if not (ready or waiting) and self._options.exit_when_idle:
+                break
+            if not ready:
+                time.sleep(self._options.poll_interval)
+        status.write(waiting, 'stopped')
+        sys.stdout.write('dbbot: %d imported, %d failed\n' % (status.imported, status.failed))
+        self._metrics.count('files_imported', status.imported)
+        self._metrics.count('files_failed', status.failed)
+        if status.failed:
+            exit(1)
+
+    def _watched_file_failed(self, xml_file, message, spool, status):
+        self._db.rollback()
+        sys.stderr.write('dbbot: error: %s\n\n' % message)
+        status.file_failed(xml_file)
+        spool.failed(xml_file)
+
+    def _import_files(self, file_paths):
+        if self._importer:
+            return self._importer.import_files(file_paths)
+        return self._import_sequentially(file_paths)
+
+    def _import_sequentially(self, file_paths):
+        for xml_file in file_paths:
+            try:
+                self._parser.xml_to_db(xml_file)
+            except data_error(), error:
+                yield xml_file, error
+            else:
+                yield xml_file, None
+
+    def _write_metrics(self):
+        if not self._options.metrics_file:
+            return
+        summary = json.dumps(self._metrics.summary(), indent=2, sort_keys=True) + '\n'
+        if self._options.metrics_file == '-':
+            sys.stdout.write(summary)
+        else:
+            with open(self._options.metrics_file, 'w') as output:
+                output.write(summary)
+
 
 if __name__ == '__main__':
     DbBot().run()
@@ -1,43 +1,184 @@
 import sqlite3
+from calendar import timegm
 
 from dbbot import RobotDatabase
+from dbbot.partitions import period_bounds
 
 
+# Orders of the rows with a limit or when ordered by the failure rate
+ORDERS = {
+    'count': 'count DESC, name',
+    'rate': 'rate DESC, count DESC, name'
+}
+
 class DatabaseReader(RobotDatabase):
 
-    def __init__(self, db_file_path, verbose_stream):
-        super(DatabaseReader, self).__init__(db_file_path, verbose_stream)
+    def __init__(self, db_file_path, verbose_stream, query_cache=None, read_only=False):
+        super(DatabaseReader, self).__init__(db_file_path, verbose_stream, query_cache,
+                                             read_only)
         self._connection.row_factory = sqlite3.Row
 
-    def most_failed_suites(self):
-        sql_statement = '''
-            SELECT count() as count, suites.id, suites.name, suites.source
-            FROM suites, suite_status
-            WHERE suites.id == suite_status.suite_id AND
-            suite_status.status == "FAIL"
-            GROUP BY suites.source
-        '''
-        return self._fetch_by(sql_statement)
+    # Rows have the number of failures as count, the number of runs and the
+    # failure rate. Over the whole history they come from the rollup tables
+    # DbBot keeps up to date at import time. The last_runs latest test runs
+    # and the test runs started in the periods from since to until, given
+    # as YYYY, YYYY-MM or YYYY-MM-DD, are counted from the status tables, as
+    # are databases last written by an older DbBot. The rows are returned as
+    # a cursor to be read one at a time, with a limit only the most failed
+    # ones by count or rate. Over partitions, see
+    # RobotDatabase.attach_partitions(), a test is grouped by the source of
+    # its suite and its name and a keyword by its name and type, as their ids
+    # differ between the partitions.
+    def most_failed_suites(self, limit=None, order_by='count', last_runs=None, since=None,
+                           until=None):
+        window, parameters = self._test_run_window('suite_status', last_runs, since, until)
+        if not window and self._has_rollups():
+            sql_statement = '''
+                SELECT sum(suite_rollups.failed) as count, sum(suite_rollups.runs) as runs,
+                sum(suite_rollups.failed) * 1.0 / sum(suite_rollups.runs) as rate,
+                suites.id, suites.name, suites.source
+                FROM suites, suite_rollups
+                WHERE suites.id == suite_rollups.suite_id
+                GROUP BY suites.source
+                HAVING count > 0
+            '''
+        else:
+            sql_statement = '''
+                SELECT sum(suite_status.status == "FAIL") as count, count() as runs,
+                sum(suite_status.status == "FAIL") * 1.0 / count() as rate,
+                suites.id, suites.name, suites.source
+                FROM suites, suite_status
+                WHERE suites.id == suite_status.suite_id %s
+                GROUP BY suites.source
+                HAVING count > 0
+            ''' % window
+        return self._iterate_most_failed(sql_statement, parameters, limit, order_by)
+
+    def most_failed_tests(self, limit=None, order_by='count', last_runs=None, since=None,
+                          until=None):
+        window, parameters = self._test_run_window('test_status', last_runs, since, until)
+        if not window and self._has_rollups():
+            sql_statement = '''
+                SELECT sum(test_rollups.failed) as count, sum(test_rollups.runs) as runs,
+                sum(test_rollups.failed) * 1.0 / sum(test_rollups.runs) as rate,
+                min(tests.id) as id, tests.name, min(tests.suite_id) as suite_id
+                FROM suites, tests, test_rollups
+                WHERE suites.id == tests.suite_id AND
+                tests.id == test_rollups.test_id
+                GROUP BY %s
+                HAVING count > 0
+                ORDER BY suite_id, tests.name
+            ''' % self._group_by('test_rollups.test_id', 'suites.source, tests.name')
+        else:
+            sql_statement = '''
+                SELECT sum(test_status.status == "FAIL") as count, count() as runs,
+                sum(test_status.status == "FAIL") * 1.0 / count() as rate,
+                min(tests.id) as id, tests.name, min(tests.suite_id) as suite_id
+                FROM suites, tests, test_status
+                WHERE suites.id == tests.suite_id AND
+                tests.id == test_status.test_id %s
+                GROUP BY %s
+                HAVING count > 0
+                ORDER BY suite_id, tests.name
+            ''' % (window, self._group_by('test_status.test_id', 'suites.source, tests.name'))
+        return self._iterate_most_failed(sql_statement, parameters, limit, order_by)
+
+    def most_failed_keywords(self, limit=None, order_by='count', last_runs=None, since=None,
+                             until=None):
+        window, parameters = self._test_run_window('keyword_status', last_runs, since, until)
+        if not window and self._has_rollups():
+            sql_statement = '''
+                SELECT sum(keyword_rollups.failed) as count, sum(keyword_rollups.runs) as runs,
+                sum(keyword_rollups.failed) * 1.0 / sum(keyword_rollups.runs) as rate,
+                keywords.name, keywords.type
+                FROM keywords, keyword_rollups
+                WHERE keywords.id == keyword_rollups.keyword_id
+                GROUP BY %s
+                HAVING count > 0
+                ORDER BY keywords.name, keywords.type
+            ''' % self._group_by('keyword_rollups.keyword_id', 'keywords.name, keywords.type')
+        else:
+            sql_statement = '''
+                SELECT sum(keyword_status.status == "FAIL") as count, count() as runs,
+                sum(keyword_status.status == "FAIL") * 1.0 / count() as rate,
+                keywords.name, keywords.type
+                FROM keywords, keyword_status
+                WHERE keywords.id == keyword_status.keyword_id %s
+                GROUP BY %s
+                HAVING count > 0
+                ORDER BY keywords.name, keywords.type
+            ''' % (window, self._group_by('keyword_status.keyword_id',
+                                          'keywords.name, keywords.type'))
+        return self._iterate_most_failed(sql_statement, parameters, limit, order_by)
 
-    def most_failed_tests(self):
+    def _group_by(self, id_column, natural_key):
+        return natural_key if self._partition_paths else id_column
+
+    # The test runs are found through index_test_runs_started_at and their
+    # status rows through the UNIQUE constraints of suite_status and
+    # test_status and through index_keyword_status_test_run_id
+    def _test_run_window(self, status_table_name, last_runs, since, until):
+        conditions = []
+        parameters = []
+        if since:
+            conditions.append('started_at >= ?')
+            parameters.append(self._timestamp(period_bounds(since)[0]))
+        if until:
+            conditions.append('started_at < ?')
+            parameters.append(self._timestamp(period_bounds(until)[1]))
+        sql_statement = 'SELECT id FROM test_runs'
+        if conditions:
+            sql_statement += ' WHERE ' + ' AND '.join(conditions)
+        if last_runs is not None:
+            sql_statement += ' ORDER BY started_at DESC LIMIT ?'
+            parameters.append(last_runs)
+        elif not conditions:
+            return '', []
+        return 'AND %s.test_run_id IN (%s)' % (status_table_name, sql_statement), parameters
+
+    # Databases created with --epoch-timestamps store milliseconds since the
+    # epoch, others DATETIME strings
+    def _timestamp(self, value):
         sql_statement = '''
-            SELECT count() as count, tests.id, tests.name, tests.suite_id
-            FROM tests, test_status
-            WHERE tests.id == test_status.test_id AND
-            test_status.status == "FAIL"
-            GROUP BY tests.name, tests.suite_id
+            SELECT typeof(started_at) FROM test_runs WHERE started_at IS NOT NULL LIMIT 1
         '''
-        return self._fetch_by(sql_statement)
+        row = self._connection.execute(sql_statement).fetchone()
+        if row and row[0] == 'integer':
+            return timegm(value.timetuple()) * 1000
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    # SQLite keeps only the limited number of rows while sorting
+    def _iterate_most_failed(self, sql_statement, parameters, limit, order_by):
+        if limit is None and order_by == 'count':
+            return self.query(sql_statement, parameters)
+        sql_statement = 'SELECT * FROM (%s) ORDER BY %s' % (sql_statement, ORDERS[order_by])
+        if limit is not None:
+            sql_statement += ' LIMIT ?'
+            parameters = parameters + [limit]
+        return self.query(sql_statement, parameters)
+
+    # The rollups are up to date once the status rows of every test run have
+    # been added into them. Every partition keeps its own rollups.
+    def _has_rollups(self):
+        return all(self._has_rollups_in(schema_name) for schema_name in self._schema_names)
 
-    def most_failed_keywords(self):
+    def _has_rollups_in(self, schema_name):
         sql_statement = '''
-            SELECT count() as count, keywords.name, keywords.type
-            FROM keywords, keyword_status
-            WHERE keywords.id == keyword_status.keyword_id AND
-            keyword_status.status == "FAIL"
-            GROUP BY keywords.name, keywords.type
-        '''
-        return self._fetch_by(sql_statement)
+            SELECT count() FROM (
+                SELECT "suite_rollups" AS name, max(id) AS last_status_id
+                FROM %(schema)s.suite_status
+                UNION ALL
+                SELECT "test_rollups", max(id) FROM %(schema)s.test_status
+                UNION ALL
+                SELECT "keyword_rollups", max(id) FROM %(schema)s.keyword_status
+            ) AS latest LEFT JOIN %(schema)s.rollup_progress
+            ON rollup_progress.name == latest.name
+            WHERE ifnull(latest.last_status_id, 0) != ifnull(rollup_progress.last_status_id, 0)
+        ''' % {'schema': schema_name}
+        try:
+            return self._connection.execute(sql_statement).fetchone()[0] == 0
+        except sqlite3.OperationalError:
+            return False
 
     def failed_tests_for_suite(self, suite_id):
         sql_statement = '''
@@ -62,5 +203,4 @@ class DatabaseReader(RobotDatabase):
         return self._fetch_by(sql_statement, [test_id])
 
     def _fetch_by(self, sql_statement, values=[]):
-        return self._connection.execute(sql_statement, values).fetchall()
-
+        return list(self.query(sql_statement, values))
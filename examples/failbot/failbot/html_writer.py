@@ -1,10 +1,18 @@
 import os
+import shutil
+import sys
+from Queue import Empty, Queue
 from string import Template
+from threading import Thread
 from xml.sax.saxutils import escape
 
 from dbbot import Logger
 
 
+# Placeholders of layout.html filled by the DatabaseReader methods of the
+# same name
+SECTIONS = ['most_failed_suites', 'most_failed_tests', 'most_failed_keywords']
+
 class HtmlWriter(object):
     template_path = os.path.abspath(__file__ + '../../../templates')
 
@@ -14,10 +22,14 @@ class HtmlWriter(object):
         "'": "&apos;"
     }
 
-    def __init__(self, db, output_file_path, verbose_stream):
+    # The query options are passed on to the most_failed_* methods of the
+    # DatabaseReader
+    def __init__(self, db, output_file_path, verbose_stream, jobs=1, **query):
         self._verbose = Logger('HTML', verbose_stream)
         self._db = db
         self._output_file_path = output_file_path
+        self._jobs = jobs
+        self._query = query
         self._init_layouts()
 
     def _init_layouts(self):
@@ -31,38 +43,108 @@ class HtmlWriter(object):
             content = file.read()
         return Template(content)
 
+    # The rows are written into the file as they are read from the database,
+    # so that neither the rows nor the page are ever in memory as a whole.
+    # The page is written next to the output file and renamed over it once
+    # complete.
     def produce(self):
         self._verbose('- Producing summaries from database')
-        output_html = self._full_layout.substitute({
-            'most_failed_suites': self._table_of_most_failed_suites(),
-            'most_failed_tests': self._table_of_most_failed_tests(),
-            'most_failed_keywords': self._table_of_most_failed_keywords()
-        })
-        self._write_file(self._output_file_path, output_html)
+        self._verbose('- Writing %s' % self._output_file_path)
+        temporary_path = self._output_file_path + '.tmp'
+        with open(temporary_path, 'w') as output:
+            if self._jobs > 1:
+                self._write_sections_in_parallel(output)
+            else:
+                self._write_layout(output, self._full_layout, dict(
+                    (name, self._table_writer(self._db, name)) for name in SECTIONS))
+        if os.name == 'nt' and os.path.exists(self._output_file_path):
+            os.remove(self._output_file_path)
+        os.rename(temporary_path, self._output_file_path)
+
+    def _table_writer(self, db, name):
+        return lambda output: self._write_table(output, getattr(db, name)(**self._query))
 
-    def _write_file(self, filename, content):
-        self._verbose('- Writing %s' % filename)
-        with open(filename, 'w') as file:
-            file.write(content)
+    # The sections are queried in up to jobs threads, each over a read-only
+    # connection of its own, and written into files next to the output. The
+    # queries run side by side as SQLite does not hold the GIL while stepping
+    # them. The files are then copied into the page in order.
+    def _write_sections_in_parallel(self, output):
+        section_paths = dict((name, '%s.%s.tmp' % (self._output_file_path, name))
+                             for name in SECTIONS)
+        try:
+            self._run_in_threads(section_paths)
+            self._write_layout(output, self._full_layout, dict(
+                (name, self._file_copier(path)) for name, path in section_paths.items()))
+        finally:
+            for path in section_paths.values():
+                if os.path.exists(path):
+                    os.remove(path)
 
-    def _table_of_most_failed_suites(self):
-        return self._format_table(self._db.most_failed_suites())
+    def _run_in_threads(self, section_paths):
+        self._verbose('- Querying %d sections in %d threads' % (
+            len(SECTIONS), min(self._jobs, len(SECTIONS))))
+        sections = Queue()
+        for name in SECTIONS:
+            sections.put(name)
+        errors = []
+        threads = [Thread(target=self._write_sections, args=(sections, section_paths, errors))
+                   for _ in range(min(self._jobs, len(SECTIONS)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
 
-    def _table_of_most_failed_tests(self):
-        return self._format_table(self._db.most_failed_tests())
+    def _write_sections(self, sections, section_paths, errors):
+        try:
+            db = self._db.open_reader()
+            try:
+                while not errors:
+                    try:
+                        name = sections.get_nowait()
+                    except Empty:
+                        break
+                    with open(section_paths[name], 'w') as output:
+                        self._table_writer(db, name)(output)
+            finally:
+                db.close()
+        except:
+            errors.append(sys.exc_info())
 
-    def _table_of_most_failed_keywords(self):
-        return self._format_table(self._db.most_failed_keywords())
+    def _file_copier(self, path):
+        def copy(output):
+            with open(path, 'r') as section:
+                shutil.copyfileobj(section, output)
+        return copy
 
-    def _format_table(self, rows):
-        return self._table_layout.substitute({
-            'rows': ''.join([self._format_row(row) for row in rows])
+    def _write_table(self, output, rows):
+        self._write_layout(output, self._table_layout, {
+            'rows': lambda output: self._write_rows(output, rows)
         })
 
+    def _write_rows(self, output, rows):
+        for row in rows:
+            output.write(self._format_row(row))
+
+    # Writes the text of the layout between the placeholders as is and lets
+    # the writer of each placeholder write its content in between
+    def _write_layout(self, output, layout, writers):
+        position = 0
+        for match in layout.pattern.finditer(layout.template):
+            name = match.group('named') or match.group('braced')
+            if name in writers:
+                output.write(Template(layout.template[position:match.start()]).substitute())
+                writers[name](output)
+                position = match.end()
+        output.write(Template(layout.template[position:]).substitute())
+
     def _format_row(self, item):
         return self._row_layout.substitute({
             'name': self._escape(item['name']),
-            'count': item['count']
+            'count': item['count'],
+            'runs': item['runs'],
+            'rate': '%.1f%%' % (item['rate'] * 100)
         })
 
     def _escape(self, text):
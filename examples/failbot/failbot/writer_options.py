@@ -1,22 +1,125 @@
 from os.path import exists
 from sys import argv
 
-from dbbot.reader.reader_options import ReaderOptions
+from dbbot.partitions import find_partitions, is_period
+from dbbot.reader.reader_options import DatabaseOptions
 
+from .database_reader import ORDERS
 
-class WriterOptions(ReaderOptions):
+
+class WriterOptions(DatabaseOptions):
 
     @property
     def output_file_path(self):
         return self._target_file
 
+    @property
+    def jobs(self):
+        return self._options.jobs
+
+    @property
+    def limit(self):
+        return self._options.limit
+
+    @property
+    def order_by(self):
+        return self._options.order_by
+
+    @property
+    def last_runs(self):
+        return self._options.last_runs
+
+    @property
+    def cache_dir(self):
+        return self._options.cache_dir
+
+    @property
+    def cache_size(self):
+        return self._options.cache_size
+
+    @property
+    def since(self):
+        return self._options.since
+
+    @property
+    def until(self):
+        return self._options.until
+
+    def _add_parser_options(self):
+        super(WriterOptions, self)._add_parser_options()
+        options = [
+            ('-j', '--jobs', {'type': 'int',
+                              'default': 1,
+                              'dest': 'jobs',
+                              'metavar': 'N',
+                              'help': 'query the suites, tests and keywords in up to N '
+                                      'threads at a time (default: %default)'}),
+
+            ('--limit', {'type': 'int',
+                         'dest': 'limit',
+                         'metavar': 'N',
+                         'help': 'list only the N most failed suites, tests and keywords'}),
+
+            ('--order-by', {'type': 'choice',
+                            'choices': sorted(ORDERS),
+                            'default': 'count',
+                            'dest': 'order_by',
+                            'help': 'order the most failed items by the number of failures '
+                                    'or by the failure rate (default: %default)'}),
+
+            ('--last-runs', {'type': 'int',
+                             'dest': 'last_runs',
+                             'metavar': 'N',
+                             'help': 'count only the failures of the N latest test runs'}),
+
+            ('--since', {'dest': 'since',
+                         'metavar': 'DATE',
+                         'help': 'count only the test runs started from DATE on, given as '
+                                 'YYYY, YYYY-MM or YYYY-MM-DD'}),
+
+            ('--until', {'dest': 'until',
+                         'metavar': 'DATE',
+                         'help': 'count only the test runs started by the end of DATE'}),
+
+            ('--cache-dir', {'dest': 'cache_dir',
+                             'metavar': 'DIR',
+                             'help': 'keep the query results in DIR and reuse them until '
+                                     'the database changes'}),
+
+            ('--cache-size', {'type': 'int',
+                              'default': 64,
+                              'dest': 'cache_size',
+                              'metavar': 'MB',
+                              'help': 'size limit of the query results kept by --cache-dir '
+                                      '(default: %default)'})
+        ]
+        for option in options:
+            self._parser.add_option(*option[:-1], **option[-1])
+        self._parser.get_option('--partition-by').help = ('read the partitions of the '
+                                                          'database written with the same '
+                                                          'option')
+
     def _get_validated_options(self):
         self._parser.set_usage('%prog [options] outfile')
         if len(argv) < 2:
             self._exit_with_help()
         options, target_files = super(WriterOptions, self)._get_validated_options()
+        self._check_files(target_files)
         self._target_file = target_files.pop()
-        if not exists(options.db_file_path):
+        if options.jobs < 1:
+            self._parser.error('number of jobs must be at least 1')
+        if options.limit is not None and options.limit < 1:
+            self._parser.error('limit must be at least 1')
+        if options.cache_size < 1:
+            self._parser.error('cache size must be at least 1 MB')
+        if options.last_runs is not None and options.last_runs < 1:
+            self._parser.error('number of last runs must be at least 1')
+        for date in (options.since, options.until):
+            if date and not is_period(date):
+                self._parser.error('invalid date "%s", expected YYYY, YYYY-MM or YYYY-MM-DD'
+                                   % date)
+        partitioned = options.partition_by and find_partitions(options.db_file_path)
+        if not exists(options.db_file_path) and not partitioned:
             self._parser.error('database "%s" does not exists' % options.db_file_path)
         return options, self._target_file
 